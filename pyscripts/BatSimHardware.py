@@ -1,18 +1,71 @@
+import logging
+from loadProfile import LoadProfileCursor
+
+log = logging.getLogger(__name__)
+
 
 # This class should implement commands to control battery simulator hardware
 # For example Keithley 2308, which has an ability to sink current.
+#
+# Without an instrument the load is simulated. With one (see scpiInstrument, e.g.
+# open_instrument('tcp://192.168.0.10:5025')) the commands run on a background
+# event loop: set_vbatt_mv() returns at once and, with prefetch, immediately
+# pipelines the measurement for the next tick behind the set, so a tick does not
+# wait for any round trip as long as the round trip is shorter than the period.
+# The current measured is then the one right after the previous voltage update.
+# Batteries sharing an instrument (see instrumentPool) also share its loop.
 class BatSimHw:
-    def __init__(self):
-        print("Hardware battery simulator, only simulated")
+    def __init__(self, instrument=None, prefetch=True, loop=None):
         self.external_load_mA = 100
+        self.load_profile = None
+        self.instrument = instrument
+        self.prefetch = prefetch
+        self._pending_measurement = None
+        self._pending_set = None
+
+        if instrument is None:
+            log.info("Hardware battery simulator, only simulated")
+        else:
+            from scpiInstrument import InstrumentLoop
+            self._own_loop = loop is None
+            self._loop = InstrumentLoop() if loop is None else loop
+            self._loop.run(instrument.connect())
 
     def measure_ibatt_ma(self):
+        if self.instrument is not None:
+            measurement = self._pending_measurement
+            if measurement is None:
+                measurement = self._loop.submit(self.instrument.measure_ibatt_ma())
+            self._pending_measurement = None
+            return measurement.result()
+
+        if self.load_profile is not None:
+            return self.load_profile.current_now()
+
         return self.external_load_mA
 
     def set_ibatt_load_ma(self, load_mA):
         self.external_load_mA = load_mA
+        self.load_profile = None
+
+    def set_load_profile(self, profile):
+        # Simulated load follows a recorded (time_s, mA) trace in real time
+        self.load_profile = LoadProfileCursor(profile)
 
     def set_vbatt_mv(self, vbatt_mv):
         # Set the output voltage on the hardware power supply
-        vbatt_mv = 0
+        if self.instrument is None:
+            return
+
+        # a failed earlier set is reported on the next one
+        if self._pending_set is not None and self._pending_set.done():
+            self._pending_set.result()
+        self._pending_set = self._loop.submit(self.instrument.set_vbatt_mv(vbatt_mv))
+        if self.prefetch:
+            self._pending_measurement = self._loop.submit(self.instrument.measure_ibatt_ma())
 
+    def close(self):
+        if self.instrument is not None:
+            self._loop.run(self.instrument.close())
+            if self._own_loop:
+                self._loop.close()
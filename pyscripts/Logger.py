@@ -1,15 +1,304 @@
-import logging
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import struct
+import threading
 import time
+import numpy as np
 
+_STOP = object()
+# put on the record queue to wake the writer up for a control request
+_WAKE = object()
 
+LOG_FIELDS = ('time', 'vocv_mv', 'vbatt_mv', 'ibatt_mA', 'vr_mv', 'vr1c1_mv', 'vr2c2_mv', 'batt_cap_mah',
+              'batt_cap_percent')
+CSV_HEADER = "time, Vocv(mv), Vbat(mA), Ibat(mA), Vr(mV), Vr1c1(mV), Vr2c2(mV), batt cap(mAh), batt cap(%)\n"
+
+# Binary logs start with BINARY_MAGIC, the header size as uint32 and a JSON header padded
+# with spaces to that size. The header describes the record layout and the simulator
+# parameters, and is followed by packed fixed-width records readable with numpy.memmap.
+BINARY_MAGIC = b'BATSIMLG'
+BINARY_HEADER_SIZE = 4096
+
+
+# Sparse sidecar index next to every log: one (time, byte offset) entry every
+# index_interval records, so readers can seek to any time without a full scan
+INDEX_SUFFIX = '.idx'
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8')])
+
+
+def binary_record_dtype(value_dtype='<f8'):
+    # time stays float64, epoch seconds do not fit in a float32
+    return np.dtype([(LOG_FIELDS[0], '<f8')] + [(field, value_dtype) for field in LOG_FIELDS[1:]])
+
+
+def format_csv_line(record):
+    return (f'{record[0]}, {record[1]}, {record[2]}, {record[3]}, {record[4]}, {record[5]}, '
+            f'{record[6]}, {record[7]}, {record[8]}\n')
+
+
+def binary_header(value_dtype, parameters):
+    header = json.dumps({'fields': list(LOG_FIELDS), 'time_dtype': '<f8', 'value_dtype': value_dtype,
+                         'parameters': parameters}).encode()
+    prefix_size = len(BINARY_MAGIC) + 4
+    if prefix_size + len(header) > BINARY_HEADER_SIZE:
+        raise ValueError("Log parameters do not fit in the binary log header")
+
+    return BINARY_MAGIC + struct.pack('<I', BINARY_HEADER_SIZE) + header.ljust(BINARY_HEADER_SIZE - prefix_size)
+
+
+# Records are queued by the control loop and written in batches by a dedicated
+# writer thread, so logging a tick never touches the disk. The queue is bounded:
+# when the writer cannot keep up, new records are dropped and counted instead of
+# stalling the caller. Parameters, flush and close go through a separate unbounded
+# control queue, so they never wait for room behind the record backlog either.
+#
+# log_format 'csv' writes the classic batsim.csv text, 'binary' writes packed
+# records (value_dtype '<f8' or '<f4') that logReader opens zero-copy.
+#
+# log_filename is a template, batsim_{run}.csv (.bin for binary) by default:
+# {run} is replaced by the start time of the run and {segment} by the segment
+# number. Files are created exclusively, a rerun that would reuse an existing
+# name gets a -1, -2, ... suffix instead of overwriting it.
+# With rotate_size_bytes and/or rotate_interval_s the log is split into segments
+# at batch boundaries, and every finished segment is gzipped by a background
+# thread (compress=None keeps them as they are).
 class BatSimLogger:
-    def __init__(self):
-        self.log_filename = "batsim.csv"
-        with open(self.log_filename, 'w') as file:
-            file.write("time, Vocv(mv), Vbat(mA), Ibat(mA), Vr(mV), Vr1c1(mV), Vr2c2(mV), batt cap(mAh), batt cap(%)\n")
+    def __init__(self, log_filename=None, flush_interval_s=1.0, flush_size=1000, queue_size=100000,
+                 log_format='csv', value_dtype='<f8', index_interval=1000, rotate_size_bytes=None,
+                 rotate_interval_s=None, compress='gzip', compress_level=6):
+        if log_format not in ('csv', 'binary'):
+            raise ValueError("Unknown log format " + str(log_format))
+        if compress not in ('gzip', None):
+            raise ValueError("Unknown compression " + str(compress))
+
+        if log_filename is None:
+            log_filename = "batsim_{run}.csv" if log_format == 'csv' else "batsim_{run}.bin"
+
+        if (rotate_size_bytes or rotate_interval_s) and '{segment' not in log_filename:
+            root, ext = os.path.splitext(log_filename)
+            log_filename = root + '_{segment:03d}' + ext
+
+        self.log_filename_template = log_filename
+        self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        self.rotate_size_bytes = rotate_size_bytes
+        self.rotate_interval_s = rotate_interval_s
+        self.compress = compress
+        self.compress_level = compress_level
+        self.log_format = log_format
+        self.value_dtype = value_dtype
+        self.flush_interval_s = flush_interval_s
+        self.flush_size = flush_size
+        self.index_interval = index_interval
+
+        self.records_logged = 0
+        self.records_written = 0
+        self.dropped_records = 0
+        self.max_backlog = 0
+
+        # every segment written so far, the last one is log_filename
+        self.segments = []
+
+        if log_format == 'csv':
+            self._header = CSV_HEADER.encode()
+        else:
+            self._record_dtype = binary_record_dtype(value_dtype)
+            self._header = binary_header(value_dtype, {})
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._control = queue.SimpleQueue()
+        self._attempt = 0
+        while True:
+            try:
+                self._open_segment(0)
+                break
+            except FileExistsError:
+                self._attempt += 1
+
+        self._compress_queue = queue.Queue()
+        self._compressor = threading.Thread(target=self._compressor_loop, name="BatSimLogCompressor", daemon=True)
+        self._compressor.start()
+        self._thread = threading.Thread(target=self._writer, name="BatSimLogger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def segment_filename(self, segment):
+        run_id = self.run_id if self._attempt == 0 else f'{self.run_id}-{self._attempt}'
+        filename = self.log_filename_template.format(run=run_id, segment=segment)
+        if self._attempt and '{run' not in self.log_filename_template:
+            root, ext = os.path.splitext(filename)
+            filename = f'{root}-{self._attempt}{ext}'
+        return filename
+
+    def _open_segment(self, segment):
+        filename = self.segment_filename(segment)
+        # CSV text is written as bytes too, so the index holds real byte offsets
+        self._file = open(filename, 'xb')
+        self._file.write(self._header)
+        self._file.flush()
+        self._offset = self._file.tell()
+        self._index_file = open(filename + INDEX_SUFFIX, 'wb')
+
+        self.log_filename = filename
+        self.segment = segment
+        self.segments.append(filename)
+        self._segment_records = 0
+        self._segment_started = time.monotonic()
+
+    def _close_segment(self):
+        self._file.close()
+        self._index_file.close()
+
+    def _rotate_if_due(self):
+        if self._segment_records == 0:
+            return
+
+        if ((self.rotate_size_bytes and self._offset >= self.rotate_size_bytes) or
+                (self.rotate_interval_s and time.monotonic() - self._segment_started >= self.rotate_interval_s)):
+            self._close_segment()
+            if self.compress:
+                self._compress_queue.put(self.log_filename)
+            self._open_segment(self.segment + 1)
+
+    def _compressor_loop(self):
+        # Streams finished segments into .gz files off the writer thread. The index
+        # keeps its uncompressed offsets and follows the data to <segment>.gz.idx.
+        while True:
+            filename = self._compress_queue.get()
+            if filename is _STOP:
+                return
+
+            with open(filename, 'rb') as source, \
+                    gzip.open(filename + '.gz', 'wb', compresslevel=self.compress_level) as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            os.replace(filename + INDEX_SUFFIX, filename + '.gz' + INDEX_SUFFIX)
+            os.remove(filename)
+            self.segments[self.segments.index(filename)] = filename + '.gz'
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
 
     def log_batsim_data(self, vocv_mv, vbatt_mv, ibat_ma, vr_mv, vr1c1_mv, vr2c2_mv, batt_cap_mah, batt_cap_percent):
-        with open(self.log_filename, 'a') as file:
-            file.write(f'{time.time()}, {vocv_mv}, {vbatt_mv}, {ibat_ma}, {vr_mv}, {vr1c1_mv}, {vr2c2_mv}, '
-                       f'{batt_cap_mah}, {batt_cap_percent}\n')
+        try:
+            self._queue.put_nowait((time.time(), vocv_mv, vbatt_mv, ibat_ma, vr_mv, vr1c1_mv, vr2c2_mv, batt_cap_mah,
+                                    batt_cap_percent))
+            self.records_logged += 1
+        except queue.Full:
+            self.dropped_records += 1
+
+    def set_parameters(self, parameters):
+        # Simulator parameters stored in the header of binary logs, ignored for CSV
+        if self.log_format == 'binary':
+            self._request(('parameters', binary_header(self.value_dtype, parameters)))
+
+    def _request(self, request):
+        self._control.put(request)
+        # a full record queue keeps the writer busy, it sees the request anyway
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass
+
+    def flush(self):
+        # Blocks until everything logged so far is on disk
+        if not self._thread.is_alive():
+            return
+
+        flushed = threading.Event()
+        self._request(flushed)
+        flushed.wait()
+
+    def close(self):
+        # Waits for the writer and for the compression of rotated segments
+        if self._thread.is_alive():
+            self._request(_STOP)
+            self._thread.join()
+        if self._compressor.is_alive():
+            self._compress_queue.put(_STOP)
+            self._compressor.join()
+
+    def _write(self, batch):
+        if batch:
+            # records whose overall number is a multiple of index_interval get an index entry
+            indexed = range((-self.records_written) % self.index_interval, len(batch), self.index_interval)
+            index = [(batch[position][0], 0) for position in indexed]
+
+            if self.log_format == 'csv':
+                boundaries = [0] + list(indexed) + [len(batch)]
+                for i, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+                    if i > 0:
+                        index[i - 1] = (index[i - 1][0], self._offset)
+                    data = ''.join(format_csv_line(record) for record in batch[start:end]).encode()
+                    self._file.write(data)
+                    self._offset += len(data)
+            else:
+                index = [(time_s, self._offset + position * self._record_dtype.itemsize)
+                         for (time_s, _), position in zip(index, indexed)]
+                data = np.array(batch, dtype=self._record_dtype).tobytes()
+                self._file.write(data)
+                self._offset += len(data)
+
+            self.records_written += len(batch)
+            self._segment_records += len(batch)
+            self._file.flush()
+
+            # the index is only extended once the data it points to is written
+            if index:
+                self._index_file.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+                self._index_file.flush()
+        else:
+            self._file.flush()
+
+    def _drain(self, batch):
+        # The records queued before a flush or close request
+        for _ in range(self._queue.qsize()):
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if record is not _WAKE:
+                batch.append(record)
+
+    def _writer(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            try:
+                record = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = None
+
+            if record is not None and record is not _WAKE:
+                batch.append(record)
+
+            while not self._control.empty():
+                request = self._control.get()
+                if request is _STOP:
+                    self._drain(batch)
+                    self._write(batch)
+                    self._close_segment()
+                    return
+
+                if isinstance(request, threading.Event):
+                    self._drain(batch)
+                    self._write(batch)
+                    batch = []
+                    request.set()
+                    continue
+
+                # ('parameters', header), also the header of every later segment
+                self._header = request[1]
+                self._file.seek(0)
+                self._file.write(request[1])
+                self._file.seek(0, 2)
 
+            if len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                self.max_backlog = max(self.max_backlog, self._queue.qsize())
+                self._write(batch)
+                batch = []
+                self._rotate_if_due()
+                deadline = time.monotonic() + self.flush_interval_s
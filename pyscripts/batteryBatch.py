@@ -0,0 +1,279 @@
+import math
+import numpy as np
+from ocvTable import OcvTable
+from loadProfile import load_profile_steps
+from batteryEngine import rc_decay_coefficients, calculate_rc_voltage
+
+
+def _per_cell(value, count):
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (count,)).copy()
+
+
+def heat_power_w(ibatt_mA, r_mohms, vrc_mv, rc_r_mohms):
+    # Vectorized version of thermalModel.heat_power_w, vrc_mv and rc_r_mohms have one row per cell
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rc_power_w = np.where(rc_r_mohms > 0, vrc_mv * vrc_mv / rc_r_mohms * 1e-3, 0).sum(axis=1)
+
+    return ibatt_mA * ibatt_mA * r_mohms * 1e-9 + rc_power_w
+
+
+# NumPy copy of a thermalModel.Table2D, looked up for all cells at once
+class Table2DArrays:
+    def __init__(self, table):
+        self.soc_percent = np.asarray(table.soc_percent)
+        self.temperature_c = np.asarray(table.temperature_c)
+        self.values = np.asarray(table.values)
+
+    @staticmethod
+    def _locate(breakpoints, value):
+        segment = np.clip(np.searchsorted(breakpoints, value, side='right') - 1, 0, len(breakpoints) - 2)
+        b0 = breakpoints[segment]
+        return segment, np.clip((value - b0) / (breakpoints[segment + 1] - b0), 0, 1)
+
+    def lookup(self, soc_percent, temperature_c):
+        s, soc_fraction = self._locate(self.soc_percent, soc_percent)
+        t, temperature_fraction = self._locate(self.temperature_c, temperature_c)
+
+        value0 = self.values[t, s] + (self.values[t, s + 1] - self.values[t, s]) * soc_fraction
+        value1 = self.values[t + 1, s] + (self.values[t + 1, s + 1] - self.values[t + 1, s]) * soc_fraction
+
+        return value0 + (value1 - value0) * temperature_fraction
+
+
+# Simulates many independent batteries at once. Every parameter and every
+# piece of state is a NumPy array with one entry per cell, so one call to
+# step() advances all of them with the same equations as BatSimEngine.
+# RC branch arrays have one row per cell and one column per branch.
+class BatSimBatch:
+    def __init__(self, count):
+        self.count = count
+        self.r_mohms = np.zeros(count)
+        self.rc_r_mohms = np.zeros((count, 0))
+        self.rc_c_F = np.zeros((count, 0))
+        self.ocv_table = None
+        self.rc_enabled = np.ones(count, dtype=bool)
+        self.battery_capacity_mah = np.zeros(count)
+        self.current_battery_capacity_mas = np.zeros(count)
+        self.battery_capacity_percent = np.zeros(count)
+
+        self.elapsed_s = 0
+        self.vbatt_mv = np.zeros(count)
+        self.ibatt_mA = np.zeros(count)
+        self.vocv_mv = np.zeros(count)
+        self.vr_mv = np.zeros(count)
+        self.vrc_mv = np.zeros((count, 0))
+
+        self._cells = np.arange(count)
+        self._ocv_soc = None
+        self._ocv_mv = None
+        self._rc_coefficients = None
+        self._rc_coefficients_dt = None
+
+        self.thermal = None
+        self.temperature_tables = None
+        self.temperature_c = np.full(count, 25.0)
+        self._temperature_arrays = {}
+
+    @property
+    def vr1c1_mv(self):
+        return self.vrc_mv[:, 0] if self.vrc_mv.shape[1] > 0 else np.zeros(self.count)
+
+    @property
+    def vr2c2_mv(self):
+        return self.vrc_mv[:, 1] if self.vrc_mv.shape[1] > 1 else np.zeros(self.count)
+
+    def update_rc_params(self, rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F, battery_initial_capacity_percent,
+                         battery_capacity_mah, ocv_table):
+        # Every argument is either a scalar shared by all cells or an array with one value per cell.
+        # Cells with rc_enabled False only see the series resistor.
+        count = self.count
+        self.set_rc_branches(np.stack([_per_cell(r1_mohms, count), _per_cell(r2_mohms, count)], axis=1),
+                             np.stack([_per_cell(c1_F, count), _per_cell(c2_F, count)], axis=1))
+        self.rc_enabled = np.broadcast_to(np.asarray(rc_enabled, dtype=bool), (count,)).copy()
+
+        self.update_battery_params(r_mohms, battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+
+    def update_battery_params(self, r_mohms, battery_initial_capacity_percent, battery_capacity_mah, ocv_table):
+        # ocv_table is an OcvTable or a list of evenly spaced voltages shared by all cells,
+        # or a 2-D array with one evenly spaced table per cell.
+        count = self.count
+        self.r_mohms = _per_cell(r_mohms, count)
+        if not isinstance(ocv_table, OcvTable) and np.ndim(ocv_table) == 1:
+            ocv_table = OcvTable.from_list(ocv_table)
+        if isinstance(ocv_table, OcvTable):
+            self._ocv_soc = np.asarray(ocv_table.soc_percent)
+            self._ocv_mv = np.asarray(ocv_table.ocv_mv)
+            self.ocv_table = ocv_table
+        else:
+            self._ocv_soc = None
+            self.ocv_table = np.broadcast_to(np.asarray(ocv_table, dtype=np.float64),
+                                             (count, np.shape(ocv_table)[-1])).copy()
+        self.battery_capacity_percent = _per_cell(battery_initial_capacity_percent, count)
+        self.battery_capacity_mah = _per_cell(battery_capacity_mah, count)
+        self.current_battery_capacity_mas = self.battery_capacity_mah * 60 * 60 * self.battery_capacity_percent / 100
+        self.vrc_mv = np.zeros(self.rc_r_mohms.shape)
+
+        if self.thermal is not None:
+            self.temperature_c = np.full(self.count, float(self.thermal.initial_c))
+
+    def set_rc_branches(self, rc_r_mohms, rc_c_F):
+        # One list of branches shared by all cells, or one row of branches per cell
+        rc_r_mohms = np.asarray(rc_r_mohms, dtype=np.float64)
+        rc_c_F = np.asarray(rc_c_F, dtype=np.float64)
+        if rc_r_mohms.shape[-1] != rc_c_F.shape[-1]:
+            raise ValueError("Every RC branch needs a resistance and a capacitance")
+
+        shape = (self.count, rc_r_mohms.shape[-1])
+        self.rc_r_mohms = np.broadcast_to(rc_r_mohms, shape).copy()
+        self.rc_c_F = np.broadcast_to(rc_c_F, shape).copy()
+        self.rc_enabled = np.ones(self.count, dtype=bool)
+        self.vrc_mv = np.zeros(shape)
+        self._rc_coefficients_dt = None
+
+    def set_temperature_model(self, thermal, temperature_tables):
+        # Same as BatSimEngine.set_temperature_model. The ThermalModel parameters are shared,
+        # every cell has its own temperature.
+        self.thermal = thermal
+        self.temperature_tables = temperature_tables
+        self._temperature_arrays = {}
+        if thermal is not None:
+            self.temperature_c = np.full(self.count, float(thermal.initial_c))
+        if temperature_tables is not None:
+            if temperature_tables.ocv is not None:
+                self._temperature_arrays['ocv'] = Table2DArrays(temperature_tables.ocv)
+            if temperature_tables.r is not None:
+                self._temperature_arrays['r'] = Table2DArrays(temperature_tables.r)
+            self._temperature_arrays['rc_r'] = [None if table is None else Table2DArrays(table)
+                                                for table in temperature_tables.rc_r]
+            self._temperature_arrays['rc_c'] = [None if table is None else Table2DArrays(table)
+                                                for table in temperature_tables.rc_c]
+
+    def update_temperature_params(self):
+        soc_percent = self.battery_capacity_percent
+        temperature_c = self.temperature_c
+        arrays = self._temperature_arrays
+        branch_count = self.rc_r_mohms.shape[1]
+        rc_changed = False
+
+        if 'r' in arrays:
+            self.r_mohms = arrays['r'].lookup(soc_percent, temperature_c)
+
+        for branch, table in enumerate(arrays['rc_r'][:branch_count]):
+            if table is not None:
+                self.rc_r_mohms[:, branch] = table.lookup(soc_percent, temperature_c)
+                rc_changed = True
+
+        for branch, table in enumerate(arrays['rc_c'][:branch_count]):
+            if table is not None:
+                self.rc_c_F[:, branch] = table.lookup(soc_percent, temperature_c)
+                rc_changed = True
+
+        if rc_changed:
+            self._rc_coefficients_dt = None
+
+    def update_temperature(self, dt_s):
+        thermal = self.thermal
+        power_w = heat_power_w(self.ibatt_mA, self.r_mohms, self.vrc_mv, self.rc_r_mohms)
+        steady_state_c = thermal.ambient_c + power_w * thermal.thermal_resistance_k_per_w
+        tau = thermal.heat_capacity_j_per_k * thermal.thermal_resistance_k_per_w
+        decay = math.exp(-dt_s / tau) if tau > 0 else 0.0
+        self.temperature_c = steady_state_c + (self.temperature_c - steady_state_c) * decay
+
+    def rc_coefficients(self, dt_s):
+        if dt_s != self._rc_coefficients_dt:
+            alpha, one_minus_alpha = rc_decay_coefficients(dt_s, self.rc_r_mohms, self.rc_c_F)
+            # disabled cells keep their branches at 0 V
+            disabled = ~self.rc_enabled
+            alpha[disabled] = 0
+            one_minus_alpha[disabled] = 0
+            self._rc_coefficients = alpha, one_minus_alpha
+            self._rc_coefficients_dt = dt_s
+
+        return self._rc_coefficients
+
+    def reset_clock(self):
+        self.elapsed_s = 0
+
+    def calculate_ocv(self):
+        capacity_mas = 60 * 60 * self.battery_capacity_mah
+        valid = capacity_mas != 0
+        self.battery_capacity_percent = np.where(
+            valid, self.current_battery_capacity_mas * 100 / np.where(valid, capacity_mas, 1),
+            self.battery_capacity_percent)
+
+        if 'ocv' in self._temperature_arrays:
+            return self._temperature_arrays['ocv'].lookup(self.battery_capacity_percent, self.temperature_c)
+
+        if self._ocv_soc is not None:
+            return np.interp(self.battery_capacity_percent, self._ocv_soc, self._ocv_mv)
+
+        last = self.ocv_table.shape[1] - 1
+        position = np.clip(self.battery_capacity_percent * last / 100, 0, last)
+        lower = np.minimum(np.floor(position).astype(np.intp), last - 1)
+        ocv_lower = self.ocv_table[self._cells, lower]
+        ocv_upper = self.ocv_table[self._cells, lower + 1]
+
+        return ocv_lower + (ocv_upper - ocv_lower) * (position - lower)
+
+    def is_drained(self):
+        return self.current_battery_capacity_mas == 0
+
+    def step(self, dt_s, ibatt_mA):
+        # ibatt_mA is a scalar or one load per cell, drawn during the last dt_s seconds
+        self.elapsed_s += dt_s
+        ibatt_mA = _per_cell(ibatt_mA, self.count)
+
+        self.current_battery_capacity_mas = np.maximum(self.current_battery_capacity_mas - ibatt_mA * dt_s, 0)
+
+        self.ibatt_mA = ibatt_mA
+        if self.thermal is not None:
+            self.update_temperature(dt_s)
+
+        self.vocv_mv = self.calculate_ocv()
+
+        if self.temperature_tables is not None:
+            self.update_temperature_params()
+
+        self.vr_mv = self.vocv_mv - ibatt_mA * self.r_mohms / 1000
+
+        # all branches of all cells in one operation
+        self.vrc_mv = calculate_rc_voltage(self.vrc_mv, ibatt_mA[:, np.newaxis], self.rc_r_mohms,
+                                           self.rc_coefficients(dt_s))
+
+        self.vbatt_mv = self.vr_mv - self.vrc_mv.sum(axis=1)
+
+        return self.vbatt_mv
+
+    def run(self, dt_s, ibatt_mA, duration_s=None, on_step=None):
+        # Steps all cells until every one of them is drained or duration_s has passed
+        if duration_s is None and np.any(np.asarray(ibatt_mA) <= 0):
+            raise ValueError("A run without duration_s needs a discharging load on every cell to end")
+
+        steps = 0
+        while not self.is_drained().all():
+            if duration_s is not None and self.elapsed_s >= duration_s:
+                break
+
+            self.step(dt_s, ibatt_mA)
+            steps += 1
+
+            if on_step is not None:
+                on_step(self)
+
+        return steps
+
+    def run_profile(self, profile, max_dt_s=None, on_step=None):
+        # Replays a load profile, stepping exactly on its breakpoints. Stops once every
+        # battery is drained or the profile is over.
+        steps = 0
+        for dt_s, ibatt_mA in load_profile_steps(profile, max_dt_s):
+            if self.is_drained().all():
+                break
+
+            self.step(dt_s, ibatt_mA)
+            steps += 1
+
+            if on_step is not None:
+                on_step(self)
+
+        return steps
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+from BatSimHardware import BatSimHw
+from Logger import BatSimLogger
+from batteryEngine import BatSimEngine, calculate_rc_voltage, rc_decay_coefficients
+from batteryLogic import BatSimCore
+
+# The same battery in every benchmark: the 2RC model of the GUI and a 100 point OCV curve
+BENCHMARK_OCV_MV = [3000 + 12 * i for i in range(101)]
+BENCHMARK_PARAMETERS = (True, 5, 50, 10, 1000, 10000, 100)
+CHART_HISTORY_POINTS = (1000, 10000, 100000)
+
+
+def best_time(function, number, repeat):
+    # Seconds per call of the fastest of `repeat` rounds of `number` calls, the
+    # round least disturbed by the rest of the machine
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(value, unit, higher_is_better):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def make_engine(capacity_mah=1000):
+    engine = BatSimEngine()
+    engine.update_rc_params(*BENCHMARK_PARAMETERS, capacity_mah, BENCHMARK_OCV_MV)
+    return engine
+
+
+def make_core(directory, capacity_mah=1e9):
+    # The core as the GUI runs it, with the simulated load for hardware and logging
+    # to a scratch directory. The capacity is large enough never to drain.
+    log = BatSimLogger(log_filename=os.path.join(directory, "tick_{run}.csv"), queue_size=1000000)
+    core = BatSimCore(BatSimHw(), log)
+    core.update_rc_params(*BENCHMARK_PARAMETERS, capacity_mah, BENCHMARK_OCV_MV)
+    return core
+
+
+def bench_tick(scale, directory):
+    # measure -> compute -> set -> log of one control tick, without the control loop thread
+    core = make_core(directory)
+    core.set_control_period(1)
+    clock = [0.0]
+
+    def tick():
+        clock[0] += 0.001
+        core.control_tick(clock[0])
+
+    seconds = best_time(tick, 20000 // scale, 5)
+    core.log.close()
+    return {'tick_us': result(seconds * 1e6, 'us', False)}
+
+
+def bench_model(scale, directory):
+    engine = make_engine()
+    engine.current_battery_capacity_mas /= 2
+    ocv_s = best_time(engine.calculate_ocv, 100000 // scale, 5)
+
+    vrc_mv = np.zeros(2)
+    rc_r_mohms = np.array([50.0, 10.0])
+    coefficients = rc_decay_coefficients(0.001, rc_r_mohms, np.array([1000.0, 10000.0]))
+    rc_s = best_time(lambda: calculate_rc_voltage(vrc_mv, 100, rc_r_mohms, coefficients), 100000 // scale, 5)
+
+    step_s = best_time(lambda: engine.step(0.001, 1), 50000 // scale, 5)
+    return {'calculate_ocv_per_s': result(1 / ocv_s, 'calls/s', True),
+            'calculate_rc_voltage_per_s': result(1 / rc_s, 'calls/s', True),
+            'engine_step_per_s': result(1 / step_s, 'calls/s', True)}
+
+
+def bench_logger(scale, directory):
+    # From the first record queued until all of them are on disk
+    results = {}
+    records = 200000 // scale
+    for log_format in ('csv', 'binary'):
+        best = None
+        for _ in range(3):
+            log = BatSimLogger(log_filename=os.path.join(directory, "logger_{run}." + log_format),
+                               queue_size=records + 1, log_format=log_format)
+            start = time.perf_counter()
+            for i in range(records):
+                log.log_batsim_data(3800.5, 3790.25, 100.0, 3799.5, 5.125, 1.0625, 990.5, 99.05)
+            log.close()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results['logger_' + log_format + '_records_per_s'] = result(records / best, 'records/s', True)
+    return results
+
+
+def bench_simulation(scale, directory):
+    # Simulated time per wall clock second: the core ticking once a simulated second,
+    # logging included, and the event driven run_adaptive of a whole discharge
+    core = make_core(directory)
+    ticks = 50000 // scale
+    start = time.perf_counter()
+    for i in range(1, ticks + 1):
+        core.control_tick(float(i))
+    core.log.flush()
+    elapsed = time.perf_counter() - start
+    core.log.close()
+
+    def adaptive():
+        engine = make_engine()
+        engine.run_adaptive(100, sample_interval_s=60)
+        return engine.elapsed_s
+
+    simulated_s = adaptive()
+    adaptive_s = best_time(adaptive, max(20 // scale, 1), 3)
+    return {'core_simulated_hours_per_s': result(ticks / 3600 / elapsed, 'h/s', True),
+            'adaptive_simulated_hours_per_s': result(simulated_s / 3600 / adaptive_s, 'h/s', True)}
+
+
+def bench_charts(scale, directory):
+    # update_vocv_graph and update_soc_graph plus the repaint of both charts, live
+    # window and whole run, offscreen. Needs PyQt6.
+    try:
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        return {}
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from batteryGuiHandler import BatSimGui
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+    for points in CHART_HISTORY_POINTS:
+        gui = BatSimGui()
+        gui.resize(1200, 900)
+        gui.ui.tabWidget.setCurrentWidget(gui.ui.tab_2)
+        gui.show()
+        app.processEvents()
+        gui.set_history_points(points)
+        for i in range(points):
+            soc = 100 - i * 100 / points
+            vocv = 3000 + soc * 12 + (i % 7)
+            gui.history.append(i, soc, vocv)
+            gui.soc_pyramid.append(i, soc)
+            gui.vocv_pyramid.append(i, vocv)
+
+        for view in ('live', 'full'):
+            gui.vocv_chart_view.view = view
+            gui.soc_change_chart_view.view = view
+
+            def refresh():
+                gui.update_vocv_graph()
+                gui.update_soc_graph()
+                gui.vocv_chart_view.repaint()
+                gui.soc_change_chart_view.repaint()
+
+            seconds = best_time(refresh, max(20 // scale, 2), 3)
+            results[f'chart_refresh_{view}_{points}_ms'] = result(seconds * 1e3, 'ms', False)
+        gui.close()
+        gui.batsim_core.log.close()
+    return results
+
+
+# name: function(scale, directory) returning {result name: result}, scale divides the iterations
+BENCHMARKS = {'tick': bench_tick, 'model': bench_model, 'logger': bench_logger, 'simulation': bench_simulation,
+              'charts': bench_charts}
+
+
+def run_benchmarks(names=None, quick=False):
+    scale = 10 if quick else 1
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        # the GUI core logs into the working directory
+        os.chdir(directory)
+        try:
+            for name in names or BENCHMARKS:
+                results.update(BENCHMARKS[name](scale, directory))
+        finally:
+            os.chdir(cwd)
+
+    return {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'processor': platform.processor(),
+                        'cpu_count': os.cpu_count()},
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'quick': quick, 'results': results}
+
+
+def compare(results, baseline, threshold=0.1):
+    # Change of every result also in the baseline, positive is better. A result
+    # more than threshold worse than its baseline is a regression.
+    comparison = {}
+    for name, current in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['value']
+        if current['higher_is_better']:
+            change = current['value'] / before - 1
+        else:
+            change = before / current['value'] - 1
+        comparison[name] = {'baseline': before, 'value': current['value'], 'change': change,
+                            'regression': change < -threshold}
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulation, logging and chart hot paths")
+    parser.add_argument('--output', help="JSON file for the results, e.g. baseline.json")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown reported as regression")
+    parser.add_argument('--only', help="comma separated benchmarks: " + ','.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help="10x fewer iterations, for a smoke test")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(',') if args.only else None
+    results = run_benchmarks(names, args.quick)
+
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            comparison = compare(results, json.load(file), args.threshold)
+        results['comparison'] = comparison
+
+    for name, current in results['results'].items():
+        line = f"{name:40s} {current['value']:14.2f} {current['unit']}"
+        if name in comparison:
+            line += f"  {comparison[name]['change'] * 100:+7.1f}% vs {comparison[name]['baseline']:.2f}"
+            if comparison[name]['regression']:
+                line += "  REGRESSION"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if any(entry['regression'] for entry in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
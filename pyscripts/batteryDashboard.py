@@ -0,0 +1,289 @@
+import argparse
+import collections
+import json
+import logging
+import sys
+import numpy as np
+from PyQt6 import QtCore
+from PyQt6.QtCore import QAbstractTableModel, QMargins, QModelIndex, Qt, QTimer
+from PyQt6.QtGui import QPainter
+from PyQt6.QtWidgets import QApplication, QHBoxLayout, QHeaderView, QPushButton, QTableView, QVBoxLayout, QWidget
+from BatSimHardware import BatSimHw
+from Logger import BatSimLogger
+from batteryGuiHandler import TICK_BUFFER_SIZE, history_points, set_axis_range
+from batteryLogic import BatSimCore
+from batterySweep import SWEEP_PARAMETERS, config_ocv_table, parse_distribution, sample_parameters
+from chartHistory import RingHistory, decimate_min_max
+
+# Table columns: header, index in the snapshot of BatSimCore (None for the state) and format
+DASHBOARD_COLUMNS = (('State', None, None), ('Time (s)', 0, "{:.0f}"), ('SoC (%)', 8, "{:.2f}"),
+                     ('Vocv (mV)', 1, "{:.2f}"), ('Vbatt (mV)', 2, "{:.2f}"), ('Ibatt (mA)', 3, "{:.2f}"),
+                     ('Capacity (mAh)', 7, "{:.2f}"))
+
+
+# One row per BatSimCore. refresh() pulls the latest tick of every core, formats
+# the cells that changed and reports all of them with a single dataChanged over
+# the rows and columns touched, so the view repaints once per refresh however
+# many batteries ticked. data() only returns the texts formatted there.
+class BatteryTableModel(QAbstractTableModel):
+    def __init__(self, cores, names):
+        QAbstractTableModel.__init__(self)
+        self.cores = cores
+        self.names = names
+        self.texts = [[''] * len(DASHBOARD_COLUMNS) for _ in cores]
+        self._shown = [None] * len(cores)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cores)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(DASHBOARD_COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.texts[index.row()][index.column()]
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() > 0:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return DASHBOARD_COLUMNS[section][0]
+        return self.names[section]
+
+    def refresh(self):
+        # Returns the rows with a new tick
+        updated = []
+        first_row = first_column = None
+        last_row = last_column = -1
+        for row, core in enumerate(self.cores):
+            texts = self.texts[row]
+            changed = []
+            state = "Running" if core.running else "Stopped"
+            if state != texts[0]:
+                texts[0] = state
+                changed.append(0)
+
+            snapshot = core.latest
+            if snapshot is not None and snapshot is not self._shown[row]:
+                self._shown[row] = snapshot
+                updated.append(row)
+                for column in range(1, len(DASHBOARD_COLUMNS)):
+                    _, field, text_format = DASHBOARD_COLUMNS[column]
+                    text = text_format.format(snapshot[field])
+                    if text != texts[column]:
+                        texts[column] = text
+                        changed.append(column)
+
+            if changed:
+                first_row = row if first_row is None else first_row
+                last_row = row
+                first_column = changed[0] if first_column is None else min(first_column, changed[0])
+                last_column = max(last_column, changed[-1])
+
+        if first_row is not None:
+            self.dataChanged.emit(self.index(first_row, first_column), self.index(last_row, last_column),
+                                  [Qt.ItemDataRole.DisplayRole])
+        return updated
+
+    def clear(self):
+        self._shown = [None] * len(self.cores)
+
+
+# N simulators at once: the table and two charts, SoC and Vbatt, with one series
+# per battery. Like BatSimGui it redraws at displayFps, with every tick of every
+# battery buffered for the charts, and only the series of the batteries that
+# ticked are redrawn.
+class BatSimDashboard(QWidget):
+    def __init__(self, cores, names=None):
+        QWidget.__init__(self)
+        self.cores = cores
+        self.names = names or [f"Battery {i + 1}" for i in range(len(cores))]
+        self.setWindowTitle(f"Battery Simulator Dashboard ({len(cores)} batteries)")
+
+        self.displayFps = 10
+        self.timer = QTimer()
+        self.timer.setInterval(round(1000 / self.displayFps))
+        self.timer.timeout.connect(self.display_timer_expired)
+
+        self.historyPoints = 200
+        self.histories = [RingHistory(self.historyPoints, 3) for _ in cores]
+        self._outdated = set()
+        self._ticks = [collections.deque(maxlen=TICK_BUFFER_SIZE) for _ in cores]
+        for core, ticks in zip(cores, self._ticks):
+            core.subscribe_ticks(ticks.append)
+
+        self.model = BatteryTableModel(cores, self.names)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setAlternatingRowColors(True)
+        # fixed row heights, the view does not measure the rows
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table_view.verticalHeader().setDefaultSectionSize(self.table_view.fontMetrics().height() + 4)
+        self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+
+        start_button = QPushButton("Start all")
+        start_button.clicked.connect(self.start_all)
+        stop_button = QPushButton("Stop all")
+        stop_button.clicked.connect(self.stop_all)
+        buttons = QHBoxLayout()
+        buttons.addWidget(start_button)
+        buttons.addWidget(stop_button)
+        buttons.addStretch()
+
+        self.soc_chart_view, self.soc_series, self.soc_axis_x, self.soc_axis_y = self.draw_chart("SoC (%)")
+        self.soc_axis_y.setRange(0, 100)
+        self.vbatt_chart_view, self.vbatt_series, self.vbatt_axis_x, self.vbatt_axis_y = self.draw_chart("Vbatt (mV)")
+        charts = QHBoxLayout()
+        charts.addWidget(self.soc_chart_view)
+        charts.addWidget(self.vbatt_chart_view)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table_view, 1)
+        layout.addLayout(charts, 1)
+
+        self.model.refresh()
+
+    def draw_chart(self, title):
+        from PyQt6.QtCharts import QChart, QChartView, QLineSeries, QValueAxis
+
+        chart = QChart()
+        chart.setTheme(QChart.ChartTheme.ChartThemeDark)
+        chart.setMargins(QMargins(0, 0, 0, 0))
+        chart.layout().setContentsMargins(0, 0, 0, 0)
+        # a legend of dozens of batteries is useless, the table names them
+        chart.legend().hide()
+
+        axis_x = QValueAxis()
+        axis_x.setRange(0, 10)
+        axis_x.setLabelFormat("%d")
+        axis_x.setTitleText("Time (s)")
+        axis_y = QValueAxis()
+        axis_y.setLabelFormat("%d")
+        axis_y.setTitleText(title)
+        chart.addAxis(axis_x, QtCore.Qt.AlignmentFlag.AlignBottom)
+        chart.addAxis(axis_y, QtCore.Qt.AlignmentFlag.AlignLeft)
+
+        series = []
+        for name in self.names:
+            line = QLineSeries()
+            line.setName(name)
+            chart.addSeries(line)
+            line.attachAxis(axis_x)
+            line.attachAxis(axis_y)
+            series.append(line)
+
+        # no antialiasing: with dozens of series it is most of the drawing cost
+        chart_view = QChartView(chart)
+        chart_view.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+        return chart_view, series, axis_x, axis_y
+
+    def set_display_fps(self, fps):
+        self.displayFps = fps
+        self.timer.setInterval(round(1000 / fps))
+
+    def set_history_points(self, points):
+        self.historyPoints = points
+        self.histories = [RingHistory(points, 3) for _ in self.cores]
+
+    def start_all(self):
+        self.model.clear()
+        for history, ticks in zip(self.histories, self._ticks):
+            history.clear()
+            ticks.clear()
+        for core in self.cores:
+            core.start()
+        self.timer.start()
+
+    def stop_all(self):
+        for core in self.cores:
+            core.stop()
+        self.timer.stop()
+        self.display_timer_expired()
+
+    def display_timer_expired(self):
+        # the table shows the latest ticks, the charts get all the ticks since the last frame
+        self.model.refresh()
+        for row, ticks in enumerate(self._ticks):
+            if ticks:
+                history = self.histories[row]
+                for _ in range(len(ticks)):
+                    snapshot = ticks.popleft()
+                    history.append(snapshot[0], snapshot[8], snapshot[2])
+                self._outdated.add(row)
+
+        if self._outdated:
+            self.update_charts()
+
+    def update_charts(self):
+        buckets = max(self.soc_chart_view.width() // 2, 1)
+        for row in self._outdated:
+            history = self.histories[row]
+            x, soc = decimate_min_max(history.column(0), history.column(1), buckets)
+            self.soc_series[row].replace(history_points(x, soc))
+            x, vbatt = decimate_min_max(history.column(0), history.column(2), buckets)
+            self.vbatt_series[row].replace(history_points(x, vbatt))
+        self._outdated.clear()
+
+        # the axes span all the batteries
+        shown = [history for history in self.histories if len(history)]
+        if shown:
+            x_ranges = [history.range(0) for history in shown]
+            vbatt_ranges = [history.range(2) for history in shown]
+            x_range = (min(start for start, _ in x_ranges), max(end for _, end in x_ranges))
+            set_axis_range(self.soc_axis_x, *x_range)
+            set_axis_range(self.vbatt_axis_x, *x_range)
+            set_axis_range(self.vbatt_axis_y, min(low for low, _ in vbatt_ranges),
+                           max(high for _, high in vbatt_ranges))
+
+
+def create_cores(config, cells, seed=0, load_mA=100, period_ms=1000):
+    # One simulated BatSimCore per cell, the parameters drawn from the distributions
+    # of a batterySweep config, each cell logging to its own file
+    ocv_table = config_ocv_table(config)
+    distributions = {name: parse_distribution(config[name]) for name in SWEEP_PARAMETERS}
+    cores = []
+    for cell, cell_seed in enumerate(np.random.SeedSequence(seed).spawn(cells)):
+        parameters = sample_parameters(distributions, cell_seed)
+        batsimHw = BatSimHw()
+        batsimHw.set_ibatt_load_ma(load_mA)
+        core = BatSimCore(batsimHw, BatSimLogger(log_filename=f"batsim_{{run}}_cell{cell + 1:02d}.csv"))
+        core.update_rc_params(True, parameters['r_mohms'], parameters['r1_mohms'], parameters['r2_mohms'],
+                              parameters['c1_F'], parameters['c2_F'], parameters['battery_initial_capacity_percent'],
+                              parameters['battery_capacity_mah'], ocv_table)
+        core.set_control_period(period_ms)
+        cores.append(core)
+    return cores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dashboard of many simulated batteries")
+    parser.add_argument('config', help="batterySweep config: a distribution for every parameter and 'ocv_table'")
+    parser.add_argument('--cells', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load-ma', type=float, default=100)
+    parser.add_argument('--period-ms', type=float, default=1000)
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--log-level', default='warning', choices=('debug', 'info', 'warning', 'error'))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    with open(args.config, 'r') as file:
+        config = json.load(file)
+
+    app = QApplication(sys.argv[:1])
+    dashboard = BatSimDashboard(create_cores(config, args.cells, args.seed, args.load_ma, args.period_ms))
+    dashboard.set_display_fps(args.fps)
+    dashboard.resize(1200, 900)
+    dashboard.show()
+    app.exec()
+    dashboard.stop_all()
+    for core in dashboard.cores:
+        core.log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import bisect
+import math
+import numpy as np
+from ocvTable import OcvTable
+from loadProfile import load_profile_segments, load_profile_steps
+from thermalModel import heat_power_w
+from tickProfiler import STAGE_OCV, STAGE_RC
+
+
+def rc_decay_coefficients(dt_s, r_mohms, c_F):
+    # Exact zero-order-hold discretization of RC branches: with the current
+    # held constant over dt_s, vrc[k+1] = alpha * vrc[k] + (1 - alpha) * ibatt * R
+    # Works on scalars as well as on arrays of branches.
+    tau = np.asarray(r_mohms * c_F / 1e3, dtype=np.float64)
+
+    # without a capacitor the branch follows the current immediately
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = np.where(tau > 0, np.exp(-dt_s / np.where(tau > 0, tau, 1)), 0.0)
+
+    return alpha, 1 - alpha
+
+
+def calculate_rc_voltage(vprev_mv, ibatt_mA, r_mohms, coefficients):
+    alpha, one_minus_alpha = coefficients
+    return alpha * vprev_mv + one_minus_alpha * ibatt_mA * r_mohms / 1000
+
+
+# Battery model without any dependency on Qt or on the wall clock.
+# The caller decides how much time passes on every step, so the same
+# engine can be driven by a QTimer or run a full discharge headless.
+#
+# The series resistor is followed by any number of RC branches. Their
+# resistances, capacitances and voltages live in arrays with one entry per
+# branch and are all updated by a single vectorized operation.
+class BatSimEngine:
+    def __init__(self):
+        self.r_mohms = 0
+        self.rc_r_mohms = np.zeros(0)
+        self.rc_c_F = np.zeros(0)
+        self.ocv_table = None
+        self.rc_enabled = True
+        self.battery_capacity_mah = 0
+        self.current_battery_capacity_mas = 0
+        self.battery_capacity_percent = 0
+
+        self.elapsed_s = 0
+        self.vbatt_mv = 0
+        self.ibatt_mA = 0
+        self.vocv_mv = 0
+        self.vr_mv = 0
+        self.vrc_mv = np.zeros(0)
+
+        # Optional temperature dependency, see set_temperature_model
+        self.thermal = None
+        self.temperature_tables = None
+        self.temperature_c = 25
+
+        # (alpha, 1 - alpha) arrays of the RC branches for the time step in _rc_coefficients_dt
+        self._rc_coefficients = None
+        self._rc_coefficients_dt = None
+
+        # Optional TickProfiler, step() marks its OCV and RC stages
+        self.profiler = None
+
+    @property
+    def vr1c1_mv(self):
+        return float(self.vrc_mv[0]) if len(self.vrc_mv) > 0 else 0
+
+    @property
+    def vr2c2_mv(self):
+        return float(self.vrc_mv[1]) if len(self.vrc_mv) > 1 else 0
+
+    def update_rc_params(self, rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F, battery_initial_capacity_percent,
+                         battery_capacity_mah, ocv_table):
+        # The 2RC model of the GUI, disabling RC leaves only the series resistor
+        self.rc_enabled = rc_enabled
+        if rc_enabled:
+            self.set_rc_branches([r1_mohms, r2_mohms], [c1_F, c2_F])
+        else:
+            self.set_rc_branches([], [])
+
+        self.update_battery_params(r_mohms, battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+
+    def update_battery_params(self, r_mohms, battery_initial_capacity_percent, battery_capacity_mah, ocv_table):
+        self.r_mohms = r_mohms
+        # ocv_table is an OcvTable or a list of voltages evenly spaced from 0% to 100%
+        if not isinstance(ocv_table, OcvTable):
+            ocv_table = OcvTable.from_list(ocv_table)
+        self.ocv_table = ocv_table
+        self.battery_capacity_percent = battery_initial_capacity_percent
+        self.battery_capacity_mah = battery_capacity_mah
+        self.current_battery_capacity_mas = battery_capacity_mah * 60 * 60 * battery_initial_capacity_percent / 100
+        self.vrc_mv = np.zeros(len(self.rc_r_mohms))
+
+        if self.thermal is not None:
+            self.thermal.reset()
+            self.temperature_c = self.thermal.temperature_c
+
+    def set_rc_branches(self, rc_r_mohms, rc_c_F):
+        # Any number of RC branches in series, zero branches is the plain R model
+        if len(rc_r_mohms) != len(rc_c_F):
+            raise ValueError("Every RC branch needs a resistance and a capacitance")
+
+        self.rc_r_mohms = np.array(rc_r_mohms, dtype=np.float64)
+        self.rc_c_F = np.array(rc_c_F, dtype=np.float64)
+        self.vrc_mv = np.zeros(len(self.rc_r_mohms))
+        self._rc_coefficients_dt = None
+
+    def set_temperature_model(self, thermal, temperature_tables):
+        # thermal is a ThermalModel updating temperature_c every step, or None to keep
+        # temperature_c constant. temperature_tables is a TemperatureTables or None.
+        self.thermal = thermal
+        self.temperature_tables = temperature_tables
+        if thermal is not None:
+            self.temperature_c = thermal.temperature_c
+
+    def update_temperature_params(self):
+        # Parameters with a table follow the current SoC and temperature, the others
+        # keep the value from update_rc_params
+        tables = self.temperature_tables
+        soc_percent = self.battery_capacity_percent
+        temperature_c = self.temperature_c
+        branch_count = len(self.rc_r_mohms)
+        rc_changed = False
+
+        if tables.r is not None:
+            self.r_mohms = tables.r.lookup(soc_percent, temperature_c)
+
+        for branch, table in enumerate(tables.rc_r[:branch_count]):
+            if table is not None:
+                self.rc_r_mohms[branch] = table.lookup(soc_percent, temperature_c)
+                rc_changed = True
+
+        for branch, table in enumerate(tables.rc_c[:branch_count]):
+            if table is not None:
+                self.rc_c_F[branch] = table.lookup(soc_percent, temperature_c)
+                rc_changed = True
+
+        if rc_changed:
+            self._rc_coefficients_dt = None
+
+    def rc_coefficients(self, dt_s):
+        # Only recomputed when the step size or the RC parameters change
+        if dt_s != self._rc_coefficients_dt:
+            self._rc_coefficients = rc_decay_coefficients(dt_s, self.rc_r_mohms, self.rc_c_F)
+            self._rc_coefficients_dt = dt_s
+
+        return self._rc_coefficients
+
+    def reset_clock(self):
+        self.elapsed_s = 0
+
+    def calculate_ocv(self):
+        if self.battery_capacity_mah != 0:
+            self.battery_capacity_percent = self.current_battery_capacity_mas * 100 / (
+                        60 * 60 * self.battery_capacity_mah)
+
+        if self.temperature_tables is not None and self.temperature_tables.ocv is not None:
+            return self.temperature_tables.ocv.lookup(self.battery_capacity_percent, self.temperature_c)
+
+        return self.ocv_table.ocv(self.battery_capacity_percent)
+
+    def is_drained(self):
+        return self.current_battery_capacity_mas == 0
+
+    def step(self, dt_s, ibatt_mA):
+        self.elapsed_s += dt_s
+
+        # Drained battery, ibatt_mA is the current drawn during the last dt_s seconds
+        self.current_battery_capacity_mas -= ibatt_mA * dt_s
+
+        if self.current_battery_capacity_mas < 0:
+            self.current_battery_capacity_mas = 0
+
+        # Heat from the last step, with the branch voltages at its start
+        if self.thermal is not None:
+            self.temperature_c = self.thermal.step(dt_s, heat_power_w(ibatt_mA, self.r_mohms, self.vrc_mv,
+                                                                      self.rc_r_mohms))
+
+        # calculate vocv
+        self.vocv_mv = self.calculate_ocv()
+
+        if self.temperature_tables is not None:
+            self.update_temperature_params()
+
+        self.ibatt_mA = ibatt_mA
+        if self.profiler is not None:
+            self.profiler.mark(STAGE_OCV)
+
+        # calculate vbatt voltage
+        self.vr_mv = self.vocv_mv - self.ibatt_mA * self.r_mohms / 1000
+
+        # calculate drop over all RC branches at once, integrated from the previous tick
+        if len(self.vrc_mv) > 0:
+            self.vrc_mv = calculate_rc_voltage(self.vrc_mv, self.ibatt_mA, self.rc_r_mohms,
+                                               self.rc_coefficients(dt_s))
+            self.vbatt_mv = self.vr_mv - float(self.vrc_mv.sum())
+        else:
+            self.vbatt_mv = self.vr_mv
+
+        if self.profiler is not None:
+            self.profiler.mark(STAGE_RC)
+        return self.vbatt_mv
+
+    def run(self, dt_s, ibatt_mA, duration_s=None, on_step=None):
+        # Fixed step simulation, as fast as the CPU allows. Stops once the battery
+        # is drained or duration_s seconds of simulated time have passed.
+        if duration_s is None and ibatt_mA <= 0:
+            raise ValueError("A run without duration_s needs a discharging load to end")
+
+        steps = 0
+        while not self.is_drained():
+            if duration_s is not None and self.elapsed_s >= duration_s:
+                break
+
+            self.step(dt_s, ibatt_mA)
+            steps += 1
+
+            if on_step is not None:
+                on_step(self)
+
+        return steps
+
+    def run_profile(self, profile, max_dt_s=None, on_step=None):
+        # Replays a load profile, stepping exactly on its breakpoints. Stops once the
+        # battery is drained or the profile is over.
+        steps = 0
+        for dt_s, ibatt_mA in load_profile_steps(profile, max_dt_s):
+            if self.is_drained():
+                break
+
+            self.step(dt_s, ibatt_mA)
+            steps += 1
+
+            if on_step is not None:
+                on_step(self)
+
+        return steps
+
+    def soc_breakpoints(self):
+        if self.temperature_tables is not None and self.temperature_tables.ocv is not None:
+            return self.temperature_tables.ocv.soc_percent
+
+        return self.ocv_table.soc_percent
+
+    def time_to_next_event(self, ibatt_mA):
+        # Seconds until the battery is empty or the SoC crosses the next OCV table breakpoint
+        # under a constant current. Returns (seconds, True if the event is the empty battery).
+        if ibatt_mA == 0 or self.battery_capacity_mah == 0:
+            return math.inf, False
+
+        breakpoints = self.soc_breakpoints()
+        soc_percent = self.battery_capacity_percent
+        mas_per_percent = self.battery_capacity_mah * 36
+
+        if ibatt_mA > 0:
+            time_to_empty_s = self.current_battery_capacity_mas / ibatt_mA
+            # highest breakpoint below the current SoC, skipping the one we may just have landed on
+            index = bisect.bisect_left(breakpoints, soc_percent - 1e-9) - 1
+            if index >= 0 and breakpoints[index] > 0:
+                time_to_breakpoint_s = (soc_percent - breakpoints[index]) * mas_per_percent / ibatt_mA
+                if time_to_breakpoint_s < time_to_empty_s:
+                    return time_to_breakpoint_s, False
+
+            return time_to_empty_s, True
+
+        index = bisect.bisect_right(breakpoints, soc_percent + 1e-9)
+        if index < len(breakpoints):
+            return (breakpoints[index] - soc_percent) * mas_per_percent / -ibatt_mA, False
+
+        return math.inf, False
+
+    def run_adaptive(self, load, sample_interval_s=None, duration_s=None, on_sample=None, max_dt_s=None,
+                     on_step=None):
+        # Event driven simulation. With a piecewise constant load the capacity, the OCV
+        # between breakpoints and the RC branches all have closed-form solutions, so the
+        # engine jumps straight to the next event: a load change, an OCV breakpoint, the
+        # empty battery, the next sample time or the end of duration_s. on_sample is called
+        # every sample_interval_s seconds with the same state a fixed step run would have,
+        # returning True from it ends the run. on_step, called the same way after every step
+        # before the sample, sees everything that happens between the samples.
+        #
+        # load is a constant ibatt_mA or a load profile. The thermal model is not piecewise
+        # constant, so with one enabled the steps are limited to max_dt_s (default 1 s).
+        if max_dt_s is None and self.thermal is not None:
+            max_dt_s = 1.0
+
+        if isinstance(load, (int, float)):
+            segments = [(0, math.inf, load)]
+        else:
+            segments = load_profile_segments(load)
+
+        end_of_run_s = math.inf if duration_s is None else duration_s
+        next_sample_s = math.inf if sample_interval_s is None else sample_interval_s
+        samples = 0
+        time_s = 0
+        steps = 0
+        offset_s = None
+        start_elapsed_s = self.elapsed_s
+
+        for start_s, end_s, ibatt_mA in segments:
+            if offset_s is None:
+                offset_s = start_s
+            segment_end_s = min(end_s - offset_s, end_of_run_s)
+
+            while time_s < segment_end_s and not self.is_drained():
+                time_to_event_s, empty = self.time_to_next_event(ibatt_mA)
+                event_s = time_s + time_to_event_s
+                # an event a rounding error away from the sample time happens at the sample
+                if abs(event_s - next_sample_s) <= 1e-9 * next_sample_s:
+                    event_s = next_sample_s
+                target_s = min(segment_end_s, next_sample_s, event_s)
+                if max_dt_s is not None:
+                    target_s = min(target_s, time_s + max_dt_s)
+
+                self.step(target_s - time_s, ibatt_mA)
+                time_s = target_s
+                # the clock follows time_s, not the sum of the rounded step sizes
+                self.elapsed_s = start_elapsed_s + time_s
+                steps += 1
+
+                if empty and target_s == event_s:
+                    # land exactly on 0%, not a rounding error above it
+                    self.current_battery_capacity_mas = 0
+                    self.battery_capacity_percent = 0
+
+                if on_step is not None and on_step(self):
+                    return steps
+
+                if target_s == next_sample_s:
+                    samples += 1
+                    next_sample_s = (samples + 1) * sample_interval_s
+                    if on_sample is not None and on_sample(self):
+                        return steps
+
+            if time_s >= end_of_run_s or self.is_drained():
+                break
+
+        return steps
@@ -0,0 +1,235 @@
+import argparse
+import math
+import numpy as np
+from ocvTable import OcvTable
+
+
+# Identifies R, the RC branches and the OCV curve from a logged (time, current,
+# voltage, SoC) trace, e.g. a pulse test or the batsim.csv of BatSimLogger.
+#
+# Vbatt[k] = OCV(SoC[k]) - Ibatt[k] * R - sum(vrc_i[k]), with every vrc_i using the
+# same zero-order-hold update as the simulator. For fixed time constants the model
+# is linear in R, the branch resistances and the OCV breakpoint voltages, so those
+# come from a linear least-squares solve and only the time constants are searched.
+# The normal equations are accumulated with O(N) passes over the trace, so a
+# 1M sample log costs a few milliseconds per candidate set of time constants.
+
+
+def load_batsim_log(filename):
+    # time_s, ibatt_mA, vbatt_mv, soc_percent from the CSV written by BatSimLogger
+    data = np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+    return data[:, 0] - data[0, 0], data[:, 3], data[:, 2], data[:, 8]
+
+
+def soc_from_current(time_s, ibatt_mA, battery_capacity_mah, initial_soc_percent):
+    # Coulomb counting for logs without a SoC column, ibatt_mA[k] flows until time_s[k]
+    dt_s = np.diff(time_s, prepend=time_s[0])
+    return initial_soc_percent - np.cumsum(ibatt_mA * dt_s) / (battery_capacity_mah * 36)
+
+
+def _time_steps(time_s):
+    dt_s = np.diff(time_s, prepend=np.nan)
+    dt_s[0] = np.median(dt_s[1:]) if len(time_s) > 1 else 1.0
+    return dt_s
+
+
+def rc_unit_response(time_s, ibatt_mA, tau_s):
+    # Voltage in mV of an RC branch with R = 1 mOhm and time constant tau_s, starting at rest:
+    # x[k] = a[k] * x[k - 1] + (1 - a[k]) * ibatt[k] / 1000, a[k] = exp(-dt[k] / tau_s).
+    # Solved in closed form over blocks short enough for exp() not to overflow.
+    dt_s = _time_steps(time_s)
+    if tau_s <= np.median(dt_s) / 20:
+        # the branch settles within a single sample
+        return ibatt_mA / 1000
+
+    gain = -np.expm1(-dt_s / tau_s) * ibatt_mA / 1000
+    x = np.empty(len(time_s))
+    state = 0.0
+    start = 0
+    while start < len(time_s):
+        t0 = time_s[start] - dt_s[start]
+        end = max(int(np.searchsorted(time_s, t0 + 500 * tau_s, side='right')), start + 1)
+        growth = np.exp(np.minimum((time_s[start:end] - t0) / tau_s, 700))
+        x[start:end] = (state + np.cumsum(gain[start:end] * growth)) / growth
+        state = x[end - 1]
+        start = end
+
+    return x
+
+
+def simulate_trace(time_s, ibatt_mA, soc_percent, r_mohms, rc_r_mohms, rc_c_F, ocv_table):
+    # Vectorized model output over a whole trace, with the discretization of BatSimEngine
+    vbatt_mv = np.interp(soc_percent, ocv_table.soc_percent, ocv_table.ocv_mv) - ibatt_mA * r_mohms / 1000
+    for rc_r, rc_c in zip(rc_r_mohms, rc_c_F):
+        vbatt_mv = vbatt_mv - rc_r * rc_unit_response(time_s, ibatt_mA, rc_r * rc_c / 1e3)
+
+    return vbatt_mv
+
+
+class FitResult:
+    def __init__(self, r_mohms, rc_r_mohms, rc_c_F, ocv_table, rms_error_mv):
+        self.r_mohms = r_mohms
+        self.rc_r_mohms = rc_r_mohms
+        self.rc_c_F = rc_c_F
+        self.ocv_table = ocv_table
+        self.rms_error_mv = rms_error_mv
+
+    def apply(self, target, battery_initial_capacity_percent, battery_capacity_mah):
+        # Loads the fitted model into a BatSimCore or BatSimEngine. A core takes it
+        # through its command queue, so it is safe while the control loop runs.
+        if hasattr(target, 'update_model_params'):
+            target.update_model_params(self.r_mohms, self.rc_r_mohms, self.rc_c_F, battery_initial_capacity_percent,
+                                       battery_capacity_mah, self.ocv_table)
+        else:
+            target.set_rc_branches(self.rc_r_mohms, self.rc_c_F)
+            target.update_battery_params(self.r_mohms, battery_initial_capacity_percent, battery_capacity_mah,
+                                         self.ocv_table)
+
+
+class _HatBasis:
+    # Piecewise linear OCV over fixed SoC breakpoints, each sample touches two basis functions
+    def __init__(self, breakpoints, soc_percent):
+        self.count = len(breakpoints)
+        self.segment = np.clip(np.searchsorted(breakpoints, soc_percent, side='right') - 1, 0, self.count - 2)
+        left = breakpoints[self.segment]
+        self.fraction = np.clip((soc_percent - left) / (breakpoints[self.segment + 1] - left), 0, 1)
+
+    def project(self, values):
+        # H^T values
+        return (np.bincount(self.segment, (1 - self.fraction) * values, minlength=self.count) +
+                np.bincount(self.segment + 1, self.fraction * values, minlength=self.count))
+
+    def gram(self):
+        # H^T H, tridiagonal
+        lower = 1 - self.fraction
+        diagonal = (np.bincount(self.segment, lower * lower, minlength=self.count) +
+                    np.bincount(self.segment + 1, self.fraction * self.fraction, minlength=self.count))
+        off_diagonal = np.bincount(self.segment, lower * self.fraction, minlength=self.count)[:-1]
+        return np.diag(diagonal) + np.diag(off_diagonal, 1) + np.diag(off_diagonal, -1)
+
+
+def _nelder_mead(cost, x0, step, iterations=200, tolerance=1e-6):
+    points = [np.asarray(x0, dtype=np.float64)]
+    for i in range(len(x0)):
+        point = points[0].copy()
+        point[i] += step
+        points.append(point)
+    costs = [cost(point) for point in points]
+
+    for _ in range(iterations):
+        order = np.argsort(costs)
+        points = [points[i] for i in order]
+        costs = [costs[i] for i in order]
+        if abs(costs[-1] - costs[0]) <= tolerance * (abs(costs[0]) + 1e-12):
+            break
+
+        centroid = np.mean(points[:-1], axis=0)
+        reflected = centroid + (centroid - points[-1])
+        reflected_cost = cost(reflected)
+        if reflected_cost < costs[0]:
+            expanded = centroid + 2 * (centroid - points[-1])
+            expanded_cost = cost(expanded)
+            if expanded_cost < reflected_cost:
+                points[-1], costs[-1] = expanded, expanded_cost
+            else:
+                points[-1], costs[-1] = reflected, reflected_cost
+        elif reflected_cost < costs[-2]:
+            points[-1], costs[-1] = reflected, reflected_cost
+        else:
+            contracted = centroid + 0.5 * (points[-1] - centroid)
+            contracted_cost = cost(contracted)
+            if contracted_cost < costs[-1]:
+                points[-1], costs[-1] = contracted, contracted_cost
+            else:
+                for i in range(1, len(points)):
+                    points[i] = points[0] + 0.5 * (points[i] - points[0])
+                    costs[i] = cost(points[i])
+
+    best = int(np.argmin(costs))
+    return points[best]
+
+
+def fit_battery_model(time_s, ibatt_mA, vbatt_mv, soc_percent, branches=2, ocv_breakpoints=21,
+                      ocv_smoothing=1e-4):
+    time_s = np.asarray(time_s, dtype=np.float64)
+    ibatt_mA = np.asarray(ibatt_mA, dtype=np.float64)
+    vbatt_mv = np.asarray(vbatt_mv, dtype=np.float64)
+    soc_percent = np.asarray(soc_percent, dtype=np.float64)
+
+    breakpoints = np.linspace(0, 100, ocv_breakpoints)
+    basis = _HatBasis(breakpoints, soc_percent)
+    sample_count = len(time_s)
+
+    # Everything not depending on the time constants is computed once
+    r_column = -ibatt_mA / 1000
+    ocv_gram = basis.gram()
+    # second difference penalty keeps breakpoints without samples on a smooth curve
+    difference = np.diff(np.eye(ocv_breakpoints), 2, axis=0)
+    ocv_gram += ocv_smoothing * sample_count / ocv_breakpoints * difference.T @ difference
+    ocv_r = basis.project(r_column)
+    r_r = r_column @ r_column
+    ocv_y = basis.project(vbatt_mv)
+    r_y = r_column @ vbatt_mv
+    y_y = vbatt_mv @ vbatt_mv
+
+    def solve(log_taus):
+        columns = [-rc_unit_response(time_s, ibatt_mA, tau_s) for tau_s in np.exp(np.sort(log_taus))]
+        size = ocv_breakpoints + 1 + len(columns)
+        gram = np.zeros((size, size))
+        rhs = np.zeros(size)
+        gram[:ocv_breakpoints, :ocv_breakpoints] = ocv_gram
+        gram[:ocv_breakpoints, ocv_breakpoints] = gram[ocv_breakpoints, :ocv_breakpoints] = ocv_r
+        gram[ocv_breakpoints, ocv_breakpoints] = r_r
+        rhs[:ocv_breakpoints] = ocv_y
+        rhs[ocv_breakpoints] = r_y
+
+        for i, column in enumerate(columns):
+            index = ocv_breakpoints + 1 + i
+            gram[:ocv_breakpoints, index] = gram[index, :ocv_breakpoints] = basis.project(column)
+            gram[ocv_breakpoints, index] = gram[index, ocv_breakpoints] = r_column @ column
+            for j in range(i + 1):
+                gram[ocv_breakpoints + 1 + j, index] = gram[index, ocv_breakpoints + 1 + j] = columns[j] @ column
+            rhs[index] = column @ vbatt_mv
+
+        theta = np.linalg.lstsq(gram, rhs, rcond=None)[0]
+        return theta, y_y - 2 * theta @ rhs + theta @ gram @ theta
+
+    dt_s = np.median(_time_steps(time_s))
+    span_s = max(time_s[-1] - time_s[0], dt_s)
+    if branches > 0:
+        # start with time constants spread between a few samples and a tenth of the trace
+        start = np.linspace(math.log(5 * dt_s), math.log(max(span_s / 10, 10 * dt_s)), branches)
+        log_taus = np.sort(_nelder_mead(lambda log_taus: solve(log_taus)[1], start, step=1.0))
+    else:
+        log_taus = np.zeros(0)
+
+    theta = solve(log_taus)[0]
+    taus = np.exp(log_taus)
+    r_mohms = float(theta[ocv_breakpoints])
+    rc_r_mohms = [float(rc_r) for rc_r in theta[ocv_breakpoints + 1:]]
+    rc_c_F = [float(tau_s * 1e3 / rc_r) if rc_r != 0 else 0.0 for tau_s, rc_r in zip(taus, rc_r_mohms)]
+    ocv_table = OcvTable(breakpoints, theta[:ocv_breakpoints])
+
+    residual = vbatt_mv - simulate_trace(time_s, ibatt_mA, soc_percent, r_mohms, rc_r_mohms, rc_c_F, ocv_table)
+    return FitResult(r_mohms, rc_r_mohms, rc_c_F, ocv_table, float(np.sqrt(np.mean(residual * residual))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit R, RC branches and the OCV curve to a batsim.csv log")
+    parser.add_argument('log', help="CSV log written by BatSimLogger")
+    parser.add_argument('--branches', type=int, default=2)
+    parser.add_argument('--ocv-breakpoints', type=int, default=21)
+    args = parser.parse_args(argv)
+
+    result = fit_battery_model(*load_batsim_log(args.log), branches=args.branches,
+                               ocv_breakpoints=args.ocv_breakpoints)
+    print(f"R (mohms): {result.r_mohms:.3f}")
+    for branch, (rc_r, rc_c) in enumerate(zip(result.rc_r_mohms, result.rc_c_F)):
+        print(f"R{branch + 1} (mohms): {rc_r:.3f}  C{branch + 1} (F): {rc_c:.3f}")
+    print("OCV table: " + ",".join(f"{soc:g}:{ocv:.1f}" for soc, ocv in
+                                   zip(result.ocv_table.soc_percent, result.ocv_table.ocv_mv)))
+    print(f"RMS error (mV): {result.rms_error_mv:.3f}")
+
+
+if __name__ == "__main__":
+    main()
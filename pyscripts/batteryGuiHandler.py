@@ -1,30 +1,106 @@
 
+import collections
+import logging
 import math
+import time
+import numpy as np
 
 from PyQt6.QtCore import QTimer
 from battery_simulator import Ui_MainWindow
 from PyQt6 import QtCore
 
 from PyQt6.QtWidgets import QApplication, QMainWindow
-from PyQt6.QtCharts import QChart, QChartView, QLineSeries, QValueAxis
-from PyQt6.QtGui import QPainter, QColor
-from PyQt6.QtCore import QPointF, QMargins, Qt
+from PyQt6.QtGui import QPainter, QColor, QKeySequence, QPolygonF, QShortcut
+from PyQt6.QtCore import QPointF, QMargins, Qt, QObject, pyqtSignal
 from batteryLogic import BatSimCore
+from chartHistory import DecimationPyramid, RingHistory, decimate_min_max
+from ocvTable import OcvTable
 from ToggleSwitch import ToggleSwitch
 
+log = logging.getLogger(__name__)
 
+# Ticks buffered between two frames, a minute of 1 ms ticks; older ones are dropped
+TICK_BUFFER_SIZE = 60000
+
+
+def history_points(x, y):
+    # Written straight into the memory of a QPolygonF instead of one QPointF per sample
+    points = QPolygonF()
+    points.resize(len(x))
+    buffer = points.data()
+    buffer.setsize(len(x) * 16)
+    xy = np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)
+    xy[:, 0] = x
+    xy[:, 1] = y
+    return points
+
+
+def set_axis_range(axis, minimum, maximum):
+    # Rescaling relayouts the whole chart, so only when the range really changed
+    if axis.min() != minimum or axis.max() != maximum:
+        axis.setRange(minimum, maximum)
+
+
+# Milliseconds spent in each startup stage, from `start` (the process start when
+# given) to the first paint of the window
+class StartupTimes:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, (now - self.last) * 1000))
+        self.last = now
+
+    def as_dict(self):
+        times = dict(self.stages)
+        times['total'] = (self.last - self.start) * 1000
+        return times
+
+    def report(self):
+        return ', '.join(f"{stage} {ms:.0f} ms" for stage, ms in self.as_dict().items())
+
+
+# Carries notifications of the core's loop thread into the GUI thread, the
+# connections are queued because the signal is emitted from another thread
+class BatSimCoreEvents(QObject):
+    stopped = pyqtSignal(object)
+
+
+# The charts are built when first needed: the OCV chart right after the first
+# paint of the window, the Vocv and SoC history charts when their tab is first
+# shown. QtCharts is only imported then.
 class BatSimGui(QMainWindow):
-    def __init__(self):
+    firstPainted = pyqtSignal()
+
+    def __init__(self, batsimHw=None):
         QMainWindow.__init__(self)
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
+        # The GUI redraws at displayFps at most, however fast the simulation runs, and
+        # only what visibly changed. Every tick is buffered for the chart history, the
+        # values show the newest one.
+        self.displayFps = 10
         self.timer = QTimer()
-        self.timer.setInterval(1000)
-        self.timer.timeout.connect(self.graph_update_timer_expired)
-
+        self.timer.setInterval(round(1000 / self.displayFps))
+        self.timer.timeout.connect(self.display_timer_expired)
+        self._ticks = collections.deque(maxlen=TICK_BUFFER_SIZE)
+        self._shown_texts = [None] * 8
+        self._graphs_outdated = False
+
+        self._painted = False
+        self.ocv_graph = None
         self.ocv_chart_view = None
-        self.batsim_core = BatSimCore(self)
+        self.vocv_graph = None
+        self.soc_change_chart = None
+        self.batsim_core = BatSimCore(batsimHw)
+        self.core_events = BatSimCoreEvents()
+        self.core_events.stopped.connect(self.on_core_stopped)
+        self.batsim_core.subscribe_stopped(self.core_events.stopped.emit)
+        self.batsim_core.subscribe_ticks(self._ticks.append)
         self.ui.battParamsPushButton.clicked.connect(self.batt_params_update_button_clicked)
         self.ui.battParamsCheckBox.stateChanged.connect(self.batt_params_enable_checkbox)
         # enable custom window hint
@@ -64,15 +140,21 @@ class BatSimGui(QMainWindow):
         self.ui.verticalLayout.addWidget(self.batsim_toggle_switch)
         self.batsim_toggle_switch.statusChanged.connect(self.on_status_changed)
 
-        # Data stored to display graphs
-        self.time_data = []
-        self.soc_change_data = []
-        self.vocv_data = []
+        # Data stored to display graphs: time, SoC and Vocv of the last historyPoints ticks
+        # for the live view, and the whole run in decimation pyramids for zoom and pan
+        self.historyPoints = 50
+        self.history = RingHistory(self.historyPoints, 3)
+        self.soc_pyramid = DecimationPyramid()
+        self.vocv_pyramid = DecimationPyramid()
+
+        self.ui.tabWidget.currentChanged.connect(self.on_tab_changed)
 
-        self.draw_ocv_graph()
-        self.draw_vocv_graph()
-        self.draw_soc_change_graph()
-        self.update_batsim_data(0, 0, 0, 0, 0, 0, 0, 0, 0)
+        # Ctrl+D shows where the tick time goes
+        self.startup = None
+        self.diagnostics = None
+        self.diagnostics_shortcut = QShortcut(QKeySequence("Ctrl+D"), self)
+        self.diagnostics_shortcut.activated.connect(self.show_diagnostics)
+        self.show_batsim_data(0, 0, 0, 0, 0, 0, 0, 0, 0)
 
     def external_load_control(self):
         if self.ui.externalLoadCheckBox.isEnabled():
@@ -80,47 +162,110 @@ class BatSimGui(QMainWindow):
         else:
             self.batsim_core.enable_external_load(self.ui.externalLoadDoubleSpinBox.value())
 
+    def on_core_stopped(self, error):
+        # the run ended, show its last tick
+        if error is not None:
+            log.warning("Simulation stopped: %s", error)
+        self.display_timer_expired()
+
+    def paintEvent(self, event):
+        QMainWindow.paintEvent(self, event)
+        if not self._painted:
+            self._painted = True
+            # once the first frame is on screen
+            QTimer.singleShot(0, self.on_first_paint)
+
+    def on_first_paint(self):
+        self.firstPainted.emit()
+        if self.ocv_graph is None:
+            self.draw_ocv_graph()
+        self.on_tab_changed(self.ui.tabWidget.currentIndex())
+
+    def history_graphs_shown(self):
+        return self.ui.tabWidget.currentWidget() is self.ui.tab_2
+
+    def on_tab_changed(self, index):
+        if not self.history_graphs_shown():
+            return
+        if self.vocv_graph is None:
+            self.draw_vocv_graph()
+            self.draw_soc_change_graph()
+        # catch up with what was recorded while the tab was hidden
+        self.graph_update_timer_expired()
+
+    def show_diagnostics(self):
+        if self.diagnostics is None:
+            from diagnosticsPanel import DiagnosticsPanel
+            self.diagnostics = DiagnosticsPanel(self.batsim_core, self.startup, self)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
+
+    def set_display_fps(self, fps):
+        self.displayFps = fps
+        self.timer.setInterval(round(1000 / fps))
+
+    def display_timer_expired(self):
+        # the ticks since the last frame, so pulses between frames reach the charts
+        snapshot = None
+        for _ in range(len(self._ticks)):
+            snapshot = self._ticks.popleft()
+            self.append_history(*snapshot)
+        if snapshot is not None:
+            self.show_batsim_data(*snapshot)
+            self._graphs_outdated = True
+
+        if self._graphs_outdated:
+            self.graph_update_timer_expired()
+
     def graph_update_timer_expired(self):
+        # the history charts are only redrawn while their tab is shown
+        if self.vocv_graph is None or not self.history_graphs_shown():
+            return
+        self._graphs_outdated = False
         self.update_vocv_graph()
         self.update_soc_graph()
 
     def on_status_changed(self, status):
-        print(f'Toggle switch status: {"On" if status else "Off"}')
+        log.debug("Toggle switch status: %s", "On" if status else "Off")
         if self.batsim_toggle_switch.getstatus():
-            print('Start Batsim')
+            log.info("Start Batsim")
             self.batsim_core.start()
             self.timer.start()
         else:
-            print('Stop Batsim')
+            log.info("Stop Batsim")
             self.batsim_core.stop()
             self.timer.stop()
 
-            # Clear data stored to display graphs
-            self.time_data = []
-            self.soc_change_data = []
-            self.vocv_data = []
-            self.update_batsim_data(0, 0, 0, 0, 0, 0, 0, 0, 0)
-
-    def update_batsim_data(self, time_delta_seconds, vocv_mv, vbatt_mv, ibat_ma, vr_mv, vr1c1_mv, vr2c2_mv, batt_cap_mah, batt_cap_percent):
-        self.ui.vocvLineEdit.setText(str(f"{vocv_mv:.2f}"))
-        self.ui.vbattLineEdit.setText(str(f"{vbatt_mv:.2f}"))
-        self.ui.ibattLineEdit.setText(str(f"{ibat_ma:.2f}"))
-        self.ui.vRLineEdit.setText(str(f"{vr_mv:.2f}"))
-        self.ui.vR1c1LineEdit.setText(str(f"{vr1c1_mv:.2f}"))
-        self.ui.vR2c2LineEdit.setText(str(f"{vr2c2_mv:.2f}"))
-        self.ui.battCapPercentLineEdit.setText(str(f"{batt_cap_percent:.2f}"))
-        self.ui.battCapMahLineEdit.setText(str(f"{batt_cap_mah:.2f}"))
-        self.ui.battStatusProgressBar.setValue(math.floor(batt_cap_percent))
-
-        self.time_data.append(time_delta_seconds)
-        self.soc_change_data.append(batt_cap_percent)
-        self.vocv_data.append(vocv_mv)
-
-        # Let us plot only latest 50 data points.
-        if len(self.time_data) == 50:
-            self.time_data.pop(0)
-            self.soc_change_data.pop(0)
-            self.vocv_data.pop(0)
+            # Clear data stored to display graphs, the loop has stopped adding ticks
+            self._ticks.clear()
+            self.history.clear()
+            self.soc_pyramid.clear()
+            self.vocv_pyramid.clear()
+            self.show_batsim_data(0, 0, 0, 0, 0, 0, 0, 0, 0)
+
+    def set_history_points(self, points):
+        # Length of the Vocv and SoC history shown, 100k points and more are fine
+        self.historyPoints = points
+        self.history = RingHistory(points, 3)
+
+    def append_history(self, time_delta_seconds, vocv_mv, vbatt_mv, ibat_ma, vr_mv, vr1c1_mv, vr2c2_mv, batt_cap_mah, batt_cap_percent):
+        self.history.append(time_delta_seconds, batt_cap_percent, vocv_mv)
+        self.soc_pyramid.append(time_delta_seconds, batt_cap_percent)
+        self.vocv_pyramid.append(time_delta_seconds, vocv_mv)
+
+    def show_batsim_data(self, time_delta_seconds, vocv_mv, vbatt_mv, ibat_ma, vr_mv, vr1c1_mv, vr2c2_mv, batt_cap_mah, batt_cap_percent):
+        texts = (f"{vocv_mv:.2f}", f"{vbatt_mv:.2f}", f"{ibat_ma:.2f}", f"{vr_mv:.2f}", f"{vr1c1_mv:.2f}",
+                 f"{vr2c2_mv:.2f}", f"{batt_cap_percent:.2f}", f"{batt_cap_mah:.2f}")
+        line_edits = (self.ui.vocvLineEdit, self.ui.vbattLineEdit, self.ui.ibattLineEdit, self.ui.vRLineEdit,
+                      self.ui.vR1c1LineEdit, self.ui.vR2c2LineEdit, self.ui.battCapPercentLineEdit,
+                      self.ui.battCapMahLineEdit)
+        # only the values whose text changed are set
+        for i, (line_edit, text) in enumerate(zip(line_edits, texts)):
+            if text != self._shown_texts[i]:
+                self._shown_texts[i] = text
+                line_edit.setText(text)
+        if self.ui.battStatusProgressBar.value() != math.floor(batt_cap_percent):
+            self.ui.battStatusProgressBar.setValue(math.floor(batt_cap_percent))
 
     def batt_params_enable_checkbox(self):
         if self.ui.battParamsCheckBox.checkState().value != 0:
@@ -135,6 +280,9 @@ class BatSimGui(QMainWindow):
             self.ui.c2DoubleSpinBox.setReadOnly(True)
 
     def draw_soc_change_graph(self):
+        from PyQt6.QtCharts import QChart, QLineSeries, QValueAxis
+        from chartView import ZoomableChartView
+
         self.soc_change_chart = QChart()
         self.soc_change_chart.setTitle("")
         self.soc_change_series = QLineSeries()
@@ -161,14 +309,19 @@ class BatSimGui(QMainWindow):
 
         self.soc_change_chart.addAxis(self.socChartocv_axis_x, QtCore.Qt.AlignmentFlag.AlignBottom)
         self.soc_change_chart.addAxis(self.socChartAxisY, QtCore.Qt.AlignmentFlag.AlignLeft)
+        self.soc_change_series.attachAxis(self.socChartocv_axis_x)
+        self.soc_change_series.attachAxis(self.socChartAxisY)
 
-        self.soc_change_chart_view = QChartView(self.soc_change_chart)
+        self.soc_change_chart_view = ZoomableChartView(self.soc_change_chart, self.socChartocv_axis_x)
         self.soc_change_chart_view.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.soc_change_chart_view.viewChanged.connect(self.update_soc_graph)
 
         self.ui.verticalLayout_4.addWidget(self.soc_change_chart_view)
         self.soc_change_chart_view.update()
 
     def draw_ocv_graph(self):
+        from PyQt6.QtCharts import QChart, QChartView, QLineSeries, QValueAxis
+
         self.ocv_graph = QChart()
         self.ocv_graph.setTitle("")
         self.ocv_graph_series = QLineSeries()
@@ -202,6 +355,9 @@ class BatSimGui(QMainWindow):
         self.ui.verticalLayout_2.addWidget(self.ocv_chart_view)
 
     def draw_vocv_graph(self):
+        from PyQt6.QtCharts import QChart, QLineSeries, QValueAxis
+        from chartView import ZoomableChartView
+
         self.vocv_graph = QChart()
         self.vocv_graph.setTitle("")
         self.vocv_graph_series = QLineSeries()
@@ -228,64 +384,70 @@ class BatSimGui(QMainWindow):
 
         self.vocv_graph.addAxis(self.vocvocv_axis_x, QtCore.Qt.AlignmentFlag.AlignBottom)
         self.vocv_graph.addAxis(self.vocv_axis_y, QtCore.Qt.AlignmentFlag.AlignLeft)
+        self.vocv_graph_series.attachAxis(self.vocvocv_axis_x)
+        self.vocv_graph_series.attachAxis(self.vocv_axis_y)
 
-        self.vocv_chart_view = QChartView(self.vocv_graph)
+        self.vocv_chart_view = ZoomableChartView(self.vocv_graph, self.vocvocv_axis_x)
         self.vocv_chart_view.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.vocv_chart_view.viewChanged.connect(self.update_vocv_graph)
 
         self.ui.verticalLayout_3.addWidget(self.vocv_chart_view)
 
-    def update_vocv_graph(self):
-        self.vocv_graph_series.clear()
-
-        for i in range(len(self.time_data)):
-            self.vocv_graph_series.append(QPointF(self.time_data[i], self.vocv_data[i]))
+    def update_history_graph(self, chart_view, series, axis_y, column, pyramid):
+        if len(self.history) == 0:
+            return
 
-        self.vocvocv_axis_x.setRange(min(self.time_data), max(self.time_data))
-
-        if len(self.vocv_data) > 1:
-            min_ocv = sorted(self.vocv_data)[1]
+        view = chart_view.view
+        if view == 'live':
+            x, y = decimate_min_max(self.history.column(0), self.history.column(column), chart_view.width())
+            x_range = self.history.range(0)
+            y_range = self.history.range(column)
         else:
-            min_ocv = min(self.vocv_data)
+            x_range = pyramid.x_range if view == 'full' else view
+            x, y = pyramid.window(x_range[0], x_range[1], 2 * chart_view.width())
+            y_range = (pyramid.y_min, pyramid.y_max) if view == 'full' or len(y) == 0 else (y.min(), y.max())
 
-        self.vocv_axis_y.setRange(min_ocv, max(self.vocv_data))
-        self.vocv_graph.removeSeries(self.vocv_graph_series)
-        self.vocv_graph.addSeries(self.vocv_graph_series)
-        self.vocv_chart_view.update()
+        series.replace(history_points(x, y))
+        set_axis_range(chart_view.axis_x, *x_range)
+        set_axis_range(axis_y, *y_range)
 
-    def update_soc_graph(self):
-        self.soc_change_series.clear()
-
-        for i in range(len(self.time_data)):
-            self.soc_change_series.append(QPointF(self.time_data[i], self.soc_change_data[i]))
+    def update_vocv_graph(self):
+        self.update_history_graph(self.vocv_chart_view, self.vocv_graph_series, self.vocv_axis_y, 2,
+                                  self.vocv_pyramid)
 
-        self.socChartocv_axis_x.setRange(min(self.time_data), max(self.time_data))
-        self.socChartAxisY.setRange(min(self.soc_change_data), max(self.soc_change_data))
-        self.soc_change_chart.removeSeries(self.soc_change_series)
-        self.soc_change_chart.addSeries(self.soc_change_series)
-        self.soc_change_chart_view.update()
+    def update_soc_graph(self):
+        self.update_history_graph(self.soc_change_chart_view, self.soc_change_series, self.socChartAxisY, 1,
+                                  self.soc_pyramid)
 
     def update_ocv_graph(self, ocvTable):
+        if self.ocv_graph is None:
+            self.draw_ocv_graph()
         self.ocv_graph_series.clear()
 
-        for i in range(len(ocvTable)):
-            self.ocv_graph_series.append(QPointF(i, ocvTable[i]))
+        for soc_percent, ocv_mv in zip(ocvTable.soc_percent, ocvTable.ocv_mv):
+            self.ocv_graph_series.append(QPointF(soc_percent, ocv_mv))
 
-        self.ocv_axis_y.setRange(min(ocvTable), max(ocvTable))
+        self.ocv_axis_y.setRange(min(ocvTable.ocv_mv), max(ocvTable.ocv_mv))
         self.ocv_graph.removeSeries(self.ocv_graph_series)
         self.ocv_graph.addSeries(self.ocv_graph_series)
         self.ocv_chart_view.update()
 
     def parseOcvTable(self):
         ocv_input_str = self.ui.ocvTableTextEdit.toPlainText()
-        ocv_list = ocv_input_str.split(',')
-        if len(ocv_list) == 101:
-            check_alpha = any(char.isdigit() for char in ocv_list)
-            if check_alpha:
-                ocvTable = list(map(int, ocv_list))
-                self.update_ocv_graph(ocvTable)
-                return ocvTable
+        ocv_list = [entry.strip() for entry in ocv_input_str.split(',') if entry.strip()]
+
+        # Either voltages evenly spaced from 0% to 100%, or "soc:voltage" pairs for non-uniform breakpoints
+        try:
+            if all(':' in entry for entry in ocv_list):
+                ocv_pairs = [entry.split(':') for entry in ocv_list]
+                ocvTable = OcvTable([float(soc) for soc, _ in ocv_pairs], [float(ocv) for _, ocv in ocv_pairs])
+            else:
+                ocvTable = OcvTable.from_list([float(ocv) for ocv in ocv_list])
+        except ValueError:
+            return []
 
-        return []
+        self.update_ocv_graph(ocvTable)
+        return ocvTable
 
     def batt_params_update_button_clicked(self):
 
@@ -308,16 +470,27 @@ class BatSimGui(QMainWindow):
             black_color = QColor(0, 0, 0)
             self.ui.ocvTableTextEdit.setStyleSheet("QTextEdit { background-color: #FFFFFF; color: #000000; }")
 
-        self.batsim_core.update_rc_params(rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F,
-                                         battery_initial_capacity_percent, battery_capacity_mAh, ocv_table)
+            self.batsim_core.update_rc_params(rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F,
+                                             battery_initial_capacity_percent, battery_capacity_mAh, ocv_table)
 
         self.ui.battStatusProgressBar.setValue(battery_initial_capacity_percent)
 
 
 class BatSimGuiHandler:
-    def __init__(self):
+    def __init__(self, batsimHw=None, startup_start=None):
+        # startup_start: time.perf_counter() at the start of the process, for the startup report
+        self.startup = StartupTimes(startup_start)
+        self.startup.mark('import')
         self.app = QApplication([])
-        self.gui = BatSimGui()
+        self.startup.mark('QApplication')
+        self.gui = BatSimGui(batsimHw)
+        self.startup.mark('UI setup')
+        self.gui.startup = self.startup
+        self.gui.firstPainted.connect(self.on_first_paint)
+
+    def on_first_paint(self):
+        self.startup.mark('first paint')
+        log.info("Startup: %s", self.startup.report())
 
     def start(self):
         self.gui.show()
@@ -1,153 +1,219 @@
-from PyQt6.QtCore import QTimer
-import math
+import queue
+import threading
 import time
 from Logger import BatSimLogger
 from BatSimHardware import BatSimHw
-
-
-def calculate_rc_voltage(time_delta, vprev_mv, v_mv, ibatt_mA, r_mohms, c_F):
-    tau = r_mohms * c_F / 1e3
-
-    if time_delta <= 5 * tau:
-        vrc_mv = vprev_mv * math.exp(-time_delta / tau) + (ibatt_mA * r_mohms / 1000) * (
-                    1 - math.exp(-time_delta / tau))
-    else:
-        # beyond 5RC, voltage drop should be equal to drop across resistor
-        vrc_mv = ibatt_mA * r_mohms / 1000
-
-    print("Tau: " + str(tau) + " vrc: " + str(vrc_mv) + " time: " + str(time_delta))
-
-    return vrc_mv
-
-
+from batteryEngine import BatSimEngine
+from controlLoop import ControlLoop
+from tickProfiler import STAGE_COMMANDS, STAGE_LOG, STAGE_MEASURE, STAGE_PUBLISH, STAGE_SET, TickProfiler
+
+
+# The simulator core, independent of the GUI. measure -> compute -> set runs on
+# its own control loop thread; the GUI and anyone else only talk to it through
+# thread-safe channels:
+# - parameter and load changes are queued as commands and run on the loop thread
+#   before its next tick, or right away while the loop is stopped,
+# - every tick replaces the `latest` snapshot, read by the GUI at its own pace,
+# - the tick subscribers get every snapshot, from the loop thread,
+# - the stopped subscribers are told, from the loop thread, when a run ends.
+#
+# enable_profiling() times every stage of the ticks, see tick_stats().
 class BatSimCore:
-    def __init__(self, ui):
-        self.r_mohms = 0
-        self.r1_mohms = 0
-        self.r2_mohms = 0
-        self.c1_F = 0
-        self.c2_F = 0
-        self.ocv_table = []
-        self.rc_enabled = True
-        self.battery_capacity_mah = 0
-        self.current_battery_capacity_mas = 0
-        self.battery_capacity_percent = 0
-
-        self.refreshRateMilliseconds = 1000
-        self.log = BatSimLogger()
-        self.timer = QTimer()
-        self.timer.setInterval(self.refreshRateMilliseconds)
-        self.timer.timeout.connect(self.batsim_update_timer_expired)
-        self.vbatt_mv = 0
-        self.ibatt_mA = 0
-        self.vocv_mv = 0
-        self.vr_mv = 0
-        self.vr1c1_mv = 0
-        self.vr2c2_mv = 0
-        self.vr1c1_prev_mv = 0
-        self.vr2c2_prev_mv = 0
+    def __init__(self, batsimHw=None, log=None):
+        self.engine = BatSimEngine()
+
+        self.controlPeriodMilliseconds = 1000
+        # period of the ticks, only changes with the next start() while running
+        self._tick_period_s = 1.0
+        self.controlPolicy = 'catch_up'
+        self.log = log or BatSimLogger()
         self.last_update_time = 0
-        self.rc_calculation_start_time = 0
         self.last_time = 0
-
-        self.batsimHw = BatSimHw()
-        self.ui = ui
+        self.control_loop = None
+        self.latest = None
+        self.stopped_subscribers = []
+        self.tick_subscribers = []
+        self.profiler = None
+
+        self.commands = queue.SimpleQueue()
+        # commands are queued while the loop runs, and run at once otherwise
+        self._commands_lock = threading.Lock()
+        self._queue_commands = False
+
+        self.batsimHw = batsimHw or BatSimHw()
+
+    def submit(self, function, *args):
+        with self._commands_lock:
+            if self._queue_commands:
+                self.commands.put((function, args))
+            else:
+                function(*args)
+
+    def _run_commands(self):
+        while True:
+            try:
+                function, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            function(*args)
 
     def enable_external_load(self, load_mA):
-        self.batsimHw.set_ibatt_load_ma(load_mA)
+        self.submit(self.batsimHw.set_ibatt_load_ma, load_mA)
+
+    def set_load_profile(self, profile):
+        self.submit(self.batsimHw.set_load_profile, profile)
 
     def update_rc_params(self, rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F, battery_initial_capacity_percent,
                          battery_capacity_mah, ocv_table):
-        self.r_mohms = r_mohms
-        self.r1_mohms = r1_mohms
-        self.r2_mohms = r2_mohms
-        self.c1_F = c1_F
-        self.c2_F = c2_F
-        self.rc_enabled = rc_enabled
-        self.ocv_table = ocv_table
-        self.battery_capacity_percent = battery_initial_capacity_percent
-        self.battery_capacity_mah = battery_capacity_mah
-        self.current_battery_capacity_mas = battery_capacity_mah * 60 * 60
+        self.submit(self._update_rc_params, rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F,
+                    battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+
+    def _update_rc_params(self, rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F, battery_initial_capacity_percent,
+                          battery_capacity_mah, ocv_table):
+        self.engine.update_rc_params(rc_enabled, r_mohms, r1_mohms, r2_mohms, c1_F, c2_F,
+                                     battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+        self.log.set_parameters({'rc_enabled': rc_enabled, 'r_mohms': r_mohms, 'r1_mohms': r1_mohms,
+                                 'r2_mohms': r2_mohms, 'c1_F': c1_F, 'c2_F': c2_F,
+                                 'battery_initial_capacity_percent': battery_initial_capacity_percent,
+                                 'battery_capacity_mah': battery_capacity_mah})
+
+    def update_model_params(self, r_mohms, rc_r_mohms, rc_c_F, battery_initial_capacity_percent, battery_capacity_mah,
+                            ocv_table):
+        # Any number of RC branches, e.g. an identified model from batteryFit
+        self.submit(self._update_model_params, r_mohms, list(rc_r_mohms), list(rc_c_F),
+                    battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+
+    def _update_model_params(self, r_mohms, rc_r_mohms, rc_c_F, battery_initial_capacity_percent, battery_capacity_mah,
+                             ocv_table):
+        self.engine.set_rc_branches(rc_r_mohms, rc_c_F)
+        self.engine.update_battery_params(r_mohms, battery_initial_capacity_percent, battery_capacity_mah, ocv_table)
+        self.log.set_parameters({'r_mohms': float(r_mohms), 'rc_r_mohms': [float(r) for r in rc_r_mohms],
+                                 'rc_c_F': [float(c) for c in rc_c_F],
+                                 'battery_initial_capacity_percent': battery_initial_capacity_percent,
+                                 'battery_capacity_mah': battery_capacity_mah})
 
     def calculate_ocv(self):
-        if self.battery_capacity_mah != 0:
-            self.battery_capacity_percent = self.current_battery_capacity_mas * 100 / (
-                        60 * 60 * self.battery_capacity_mah)
-        else:
-            self.battery_capacity_mah = 0
-
-        if self.battery_capacity_percent.is_integer():
-            ocv_mv = self.ocv_table[int(self.battery_capacity_percent)]
-        else:
-            ocv_lower = self.ocv_table[math.floor(self.battery_capacity_percent)]
-            ocv_upper = self.ocv_table[math.ceil(self.battery_capacity_percent)]
-
-            ocv_mv = (ocv_lower + (ocv_upper - ocv_lower) *
-                      (self.battery_capacity_percent - math.floor(self.battery_capacity_percent)))
-
-        return ocv_mv
-
-    def batsim_update_timer_expired(self):
-        print("timer expired.")
-        current_time = time.perf_counter()
-
-        # Drained battery
-        drained_battery = self.ibatt_mA * (current_time - self.rc_calculation_start_time)
-        self.current_battery_capacity_mas -= drained_battery
-
-        if self.current_battery_capacity_mas < 0:
-            self.current_battery_capacity_mas = 0
-
-        # calculate vocv
-        self.vocv_mv = self.calculate_ocv()
+        return self.engine.calculate_ocv()
+
+    def enable_profiling(self, window=1000):
+        # Takes effect on the next tick, also while running
+        profiler = TickProfiler(window=window)
+        self.engine.profiler = profiler
+        self.profiler = profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+        self.engine.profiler = None
+
+    def tick_stats(self):
+        # Percentiles of every tick stage over the last profiled ticks, {} without profiling
+        profiler = self.profiler
+        return profiler.stats() if profiler is not None else {}
+
+    def control_tick(self, current_time):
+        engine = self.engine
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        self._run_commands()
+        if profiler is not None:
+            profiler.mark(STAGE_COMMANDS)
 
         # measure ibatt_mA
-        self.ibatt_mA = self.batsimHw.measure_ibatt_ma()
+        ibatt_mA = self.batsimHw.measure_ibatt_ma()
+        if profiler is not None:
+            profiler.mark(STAGE_MEASURE)
+
+        # The engine advances by the whole periods since the last tick, skipped ticks
+        # included. The same dt on every on-time tick lets the engine reuse its RC
+        # coefficients. It marks its OCV and RC stages.
+        period_s = self._tick_period_s
+        engine.step(max(round((current_time - self.last_time) / period_s), 1) * period_s, ibatt_mA)
+
+        self.batsimHw.set_vbatt_mv(engine.vbatt_mv)
+        if profiler is not None:
+            profiler.mark(STAGE_SET)
+
+        snapshot = (engine.elapsed_s, engine.vocv_mv, engine.vbatt_mv, engine.ibatt_mA, engine.vr_mv,
+                    engine.vr1c1_mv, engine.vr2c2_mv, engine.current_battery_capacity_mas / 3600,
+                    engine.battery_capacity_percent)
+        self.log.log_batsim_data(*snapshot[1:])
+        if profiler is not None:
+            profiler.mark(STAGE_LOG)
+
+        # a single reference assignment, readers never see a half updated tick
+        self.latest = snapshot
+        if profiler is not None:
+            profiler.mark(STAGE_PUBLISH)
+            profiler.end()
 
-        # calculate vbatt voltage
-        self.vr_mv = self.vocv_mv - self.ibatt_mA * self.r_mohms / 1000
-
-        # Calculate vbatt
-        if not self.rc_enabled:
-            # No drop over RC circuits
-            self.vr1c1_mv = 0
-            self.vr2c2_mv = 0
+        # Update the last time
+        self.last_time = current_time
 
-        else:
-            # calculate drop over R1 C1 circuit
-            self.vr1c1_mv = calculate_rc_voltage(current_time - self.rc_calculation_start_time, self.vr1c1_prev_mv,
-                                                 self.vr_mv, self.ibatt_mA, self.r1_mohms, self.c1_F)
+        # control_tick may also be driven directly, without a loop
+        if engine.is_drained() and self.control_loop is not None:
+            self.control_loop.request_stop()
 
-            # calculate drop over R2 C2 circuit
-            self.vr2c2_mv = calculate_rc_voltage(current_time - self.rc_calculation_start_time, self.vr2c2_prev_mv,
-                                                 self.vr_mv, self.ibatt_mA, self.r2_mohms, self.c2_F)
+        return snapshot
 
-        self.vbatt_mv = self.vr_mv - self.vr1c1_mv - self.vr2c2_mv
+    def _loop_finished(self, error):
+        # On the loop thread: later commands run directly, queued ones are not lost
+        with self._commands_lock:
+            self._queue_commands = False
+            self._run_commands()
+        self.log.flush()
 
-        self.batsimHw.set_vbatt_mv(self.vbatt_mv)
+        for callback in self.stopped_subscribers:
+            callback(error)
 
-        self.log.log_batsim_data(self.vocv_mv, self.vbatt_mv, self.ibatt_mA, self.vr_mv, self.vr1c1_mv, self.vr2c2_mv,
-                                  self.current_battery_capacity_mas / 3600, self.battery_capacity_percent)
+    def subscribe_ticks(self, callback):
+        # callback(snapshot) after every tick, on the loop thread: keep it as cheap as
+        # a deque append, e.g. to hand all the ticks over to a chart history
+        self.tick_subscribers.append(callback)
 
-        self.ui.update_batsim_data(current_time - self.rc_calculation_start_time, self.vocv_mv, self.vbatt_mv,
-                                    self.ibatt_mA, self.vr_mv, self.vr1c1_mv,
-                                    self.vr2c2_mv, self.current_battery_capacity_mas / 3600,
-                                    self.battery_capacity_percent)
+    def subscribe_stopped(self, callback):
+        # callback(error) when a run ends: stop(), an empty battery, or a failed tick
+        self.stopped_subscribers.append(callback)
 
-        # Update the last time
-        self.last_time = current_time
-        self.vr1c1_prev_mv = self.vr1c1_mv
-        self.vr2c2_prev_mv = self.vr2c2_mv
+    def set_control_period(self, period_ms, policy='catch_up'):
+        # Takes effect on the next start()
+        self.controlPeriodMilliseconds = period_ms
+        self.controlPolicy = policy
+        if not self.running:
+            self._tick_period_s = period_ms / 1000
 
-        if self.current_battery_capacity_mas == 0:
-            self.stop()
+    @property
+    def running(self):
+        return self.control_loop is not None and self.control_loop.running
 
     def start(self):
-        if self.current_battery_capacity_mas > 0:
-            self.last_update_time = time.perf_counter()
-            self.rc_calculation_start_time = self.last_update_time
-            self.timer.start()
+        # like the QTimer it replaced, starting a running core does nothing
+        if self.running:
+            return
+
+        with self._commands_lock:
+            self._run_commands()
+            if self.engine.current_battery_capacity_mas <= 0:
+                return
+            self._queue_commands = True
+
+        self.last_update_time = time.perf_counter()
+        self.last_time = self.last_update_time
+        self._tick_period_s = self.controlPeriodMilliseconds / 1000
+        self.engine.reset_clock()
+        self.latest = None
+        # aligned, so cores sharing an instrument tick together
+        self.control_loop = ControlLoop(self.control_tick, self.controlPeriodMilliseconds / 1000,
+                                        self.controlPolicy, align=True)
+        self.control_loop.subscribe_finished(self._loop_finished)
+        for callback in self.tick_subscribers:
+            self.control_loop.subscribe(callback)
+        self.control_loop.start()
 
     def stop(self):
         self.last_update_time = 0
-        self.timer.stop()
+        if self.control_loop is not None:
+            self.control_loop.stop()
+        # a stopped run has no latest tick, a stopped notification still queued for
+        # the GUI must not bring it back after the GUI cleared its display
+        self.latest = None
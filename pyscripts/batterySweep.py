@@ -0,0 +1,203 @@
+import argparse
+import copy
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from batteryEngine import BatSimEngine
+from loadProfile import open_load_profile
+from ocvTable import OcvTable
+
+SWEEP_PARAMETERS = ('r_mohms', 'r1_mohms', 'c1_F', 'r2_mohms', 'c2_F', 'battery_capacity_mah',
+                    'battery_initial_capacity_percent')
+# time_to_cutoff_s is located this precisely within the step that crossed the cutoff
+CUTOFF_RESOLUTION_S = 0.001
+
+
+class Constant:
+    def __init__(self, value):
+        self.value = value
+
+    def sample(self, rng):
+        return self.value
+
+
+class Uniform:
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+
+# Physical parameters never go negative, so the normal distributions are clipped at minimum
+class Normal:
+    def __init__(self, mean, std, minimum=0):
+        self.mean = mean
+        self.std = std
+        self.minimum = minimum
+
+    def sample(self, rng):
+        return max(rng.normal(self.mean, self.std), self.minimum)
+
+
+class LogNormal:
+    def __init__(self, mean, sigma):
+        self.mean = mean
+        self.sigma = sigma
+
+    def sample(self, rng):
+        return rng.lognormal(self.mean, self.sigma)
+
+
+def parse_distribution(spec):
+    # 5 or ["uniform", 4, 6], ["normal", 5, 0.5], ["lognormal", 1.6, 0.1]
+    if isinstance(spec, (int, float)):
+        return Constant(spec)
+
+    kinds = {'constant': Constant, 'uniform': Uniform, 'normal': Normal, 'lognormal': LogNormal}
+    if spec[0] not in kinds:
+        raise ValueError("Unknown distribution " + str(spec[0]))
+
+    return kinds[spec[0]](*spec[1:])
+
+
+def sample_parameters(distributions, seed):
+    # Each run draws from its own generator, in a fixed parameter order, so a run only
+    # depends on its seed and not on the worker or chunk it ends up in
+    rng = np.random.default_rng(seed)
+    return {name: float(distributions[name].sample(rng)) for name in SWEEP_PARAMETERS}
+
+
+def locate_cutoff(previous, crossed, cutoff_mv):
+    # Engine state where Vbatt first reaches cutoff_mv in the step from the state
+    # `previous`, above it, to `crossed`, at or below it. A step of any length under
+    # constant current lands on the exact state, so the crossing is bisected on copies
+    # of the engine.
+    low_s, high_s = 0, crossed.elapsed_s - previous.elapsed_s
+    crossing = crossed
+    while high_s - low_s > CUTOFF_RESOLUTION_S:
+        middle_s = (low_s + high_s) / 2
+        trial = copy.copy(previous)
+        trial.step(middle_s, crossed.ibatt_mA)
+        if trial.vbatt_mv <= cutoff_mv:
+            high_s, crossing = middle_s, trial
+        else:
+            low_s = middle_s
+
+    return crossing
+
+
+def simulate_run(run, parameters, ocv_table, load, sample_interval_s, duration_s, cutoff_mv):
+    engine = BatSimEngine()
+    engine.update_rc_params(True, parameters['r_mohms'], parameters['r1_mohms'], parameters['r2_mohms'],
+                            parameters['c1_F'], parameters['c2_F'], parameters['battery_initial_capacity_percent'],
+                            parameters['battery_capacity_mah'], ocv_table)
+
+    soc_curve = []
+    summary = {'run': run, 'parameters': parameters, 'time_to_cutoff_s': None, 'min_vbatt_mv': None}
+    previous = [copy.copy(engine)]
+
+    def on_step(engine):
+        # Every step of the adaptive run, so load pulses between two samples count too.
+        # Vbatt is checked at the end of the steps, which end on every load change.
+        crossed = cutoff_mv is not None and engine.vbatt_mv <= cutoff_mv
+        if crossed:
+            engine = locate_cutoff(previous[0], engine, cutoff_mv)
+
+        if summary['min_vbatt_mv'] is None or engine.vbatt_mv < summary['min_vbatt_mv']:
+            summary['min_vbatt_mv'] = engine.vbatt_mv
+
+        if crossed or engine.is_drained():
+            summary['time_to_cutoff_s'] = engine.elapsed_s
+            soc_curve.append((engine.elapsed_s, engine.battery_capacity_percent))
+            return True
+
+        previous[0] = copy.copy(engine)
+        return False
+
+    def on_sample(engine):
+        soc_curve.append((engine.elapsed_s, engine.battery_capacity_percent))
+        return False
+
+    engine.run_adaptive(load, sample_interval_s=sample_interval_s, duration_s=duration_s, on_sample=on_sample,
+                        on_step=on_step)
+
+    # The run may also end between two samples at the end of the profile or of duration_s
+    if summary['time_to_cutoff_s'] is None and (not soc_curve or soc_curve[-1][0] != engine.elapsed_s):
+        soc_curve.append((engine.elapsed_s, engine.battery_capacity_percent))
+
+    summary['soc_curve'] = soc_curve
+    return summary
+
+
+def _run_chunk(runs, parameters, ocv_table, load, sample_interval_s, duration_s, cutoff_mv):
+    return [simulate_run(run, run_parameters, ocv_table, load, sample_interval_s, duration_s, cutoff_mv)
+            for run, run_parameters in zip(runs, parameters)]
+
+
+def run_sweep(distributions, ocv_table, load, runs, seed=0, workers=None, chunk_size=None, sample_interval_s=60,
+              duration_s=None, cutoff_mv=None):
+    # Monte Carlo sweep over SWEEP_PARAMETERS. distributions maps every parameter to a
+    # distribution (or a plain number), load is a constant ibatt_mA or a load profile.
+    # Runs are fanned out in chunks over a process pool, and the per-run summaries are
+    # yielded as soon as their chunk is done, so they arrive out of order.
+    distributions = {name: distributions[name] if hasattr(distributions[name], 'sample')
+                     else parse_distribution(distributions[name]) for name in SWEEP_PARAMETERS}
+    workers = workers or os.cpu_count()
+    if chunk_size is None:
+        # a few chunks per worker keeps them all busy until the end
+        chunk_size = max(1, runs // (workers * 8))
+
+    seeds = np.random.SeedSequence(seed).spawn(runs)
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = []
+        for start in range(0, runs, chunk_size):
+            chunk = range(start, min(start + chunk_size, runs))
+            parameters = [sample_parameters(distributions, seeds[run]) for run in chunk]
+            futures.append(pool.submit(_run_chunk, list(chunk), parameters, ocv_table, load, sample_interval_s,
+                                       duration_s, cutoff_mv))
+
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def config_ocv_table(config):
+    # 'ocv_table' of a config is a CSV file name or a list of voltages from 0% to 100%
+    ocv_table = config['ocv_table']
+    if isinstance(ocv_table, str):
+        return OcvTable.from_csv(ocv_table)
+    return OcvTable.from_list(ocv_table)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo battery parameter sweep, one JSON summary per line")
+    parser.add_argument('config', help="JSON file with a distribution for every sweep parameter and 'ocv_table'")
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--load-ma', type=float, default=100, help="constant load when no --profile is given")
+    parser.add_argument('--profile', help="load profile, CSV or binary")
+    parser.add_argument('--sample-interval', type=float, default=60)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--cutoff-mv', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r') as file:
+        config = json.load(file)
+
+    ocv_table = config_ocv_table(config)
+    load = open_load_profile(args.profile) if args.profile else args.load_ma
+
+    for summary in run_sweep(config, ocv_table, load, args.runs, seed=args.seed, workers=args.workers,
+                             chunk_size=args.chunk_size, sample_interval_s=args.sample_interval,
+                             duration_s=args.duration, cutoff_mv=args.cutoff_mv):
+        sys.stdout.write(json.dumps(summary) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import collections
+import numpy as np
+
+
+# Minimum or maximum of the last `window` values in O(1) amortized per value:
+# a monotonic deque of (sample number, value) candidates
+class SlidingExtremum:
+    def __init__(self, window, maximum=False):
+        self.window = window
+        self.maximum = maximum
+        self._candidates = collections.deque()
+
+    def clear(self):
+        self._candidates.clear()
+
+    def push(self, number, value):
+        candidates = self._candidates
+        if self.maximum:
+            while candidates and candidates[-1][1] <= value:
+                candidates.pop()
+        else:
+            while candidates and candidates[-1][1] >= value:
+                candidates.pop()
+        candidates.append((number, value))
+        while candidates[0][0] <= number - self.window:
+            candidates.popleft()
+
+    @property
+    def value(self):
+        return self._candidates[0][1] if self._candidates else None
+
+
+# Last `capacity` rows of a few float columns in preallocated NumPy arrays, with
+# the running minimum and maximum of every column over the window.
+class RingHistory:
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = columns
+        self.data = np.zeros((columns, capacity))
+        self.minimum = [SlidingExtremum(capacity) for _ in range(columns)]
+        self.maximum = [SlidingExtremum(capacity, True) for _ in range(columns)]
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.total = 0
+        for extremum in self.minimum + self.maximum:
+            extremum.clear()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *values):
+        position = self.total % self.capacity
+        self.data[:, position] = values
+        for column, value in enumerate(values):
+            self.minimum[column].push(self.total, value)
+            self.maximum[column].push(self.total, value)
+        self.total += 1
+        self.count = min(self.count + 1, self.capacity)
+
+    def column(self, column):
+        # Oldest first, a view while the buffer has not wrapped yet
+        if self.count < self.capacity:
+            return self.data[column, :self.count]
+        position = self.total % self.capacity
+        return np.concatenate((self.data[column, position:], self.data[column, :position]))
+
+    def range(self, column):
+        return self.minimum[column].value, self.maximum[column].value
+
+
+def decimate_min_max(x, y, buckets):
+    # At most 2 * buckets points keeping the minimum and maximum of every bucket in
+    # time order, so a line drawn through them looks the same at one bucket per pixel
+    count = len(x)
+    if count <= 2 * buckets:
+        return x, y
+
+    size = count // buckets
+    usable = size * buckets
+    blocks = y[count - usable:].reshape(buckets, size)
+    offsets = np.arange(buckets) * size + (count - usable)
+    low = offsets + blocks.argmin(axis=1)
+    high = offsets + blocks.argmax(axis=1)
+    indices = np.sort(np.concatenate(([0], low, high)))
+    return x[indices], y[indices]
+
+
+class _PyramidLevel:
+    # Buckets of one pyramid level in growable arrays: first x, and the x and y of the minimum and maximum
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.start_x = np.empty(capacity)
+        self.min_x = np.empty(capacity)
+        self.min_y = np.empty(capacity)
+        self.max_x = np.empty(capacity)
+        self.max_y = np.empty(capacity)
+
+    def append(self, start_x, min_x, min_y, max_x, max_y):
+        if self.count == len(self.start_x):
+            for name in ('start_x', 'min_x', 'min_y', 'max_x', 'max_y'):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate((array, np.empty(len(array)))))
+
+        i = self.count
+        self.start_x[i] = start_x
+        self.min_x[i] = min_x
+        self.min_y[i] = min_y
+        self.max_x[i] = max_x
+        self.max_y[i] = max_y
+        self.count += 1
+
+    def points(self, first, last):
+        # Minimum and maximum of buckets [first, last) in time order
+        min_first = self.min_x[first:last] <= self.max_x[first:last]
+        x = np.where(min_first, [self.min_x[first:last], self.max_x[first:last]],
+                     [self.max_x[first:last], self.min_x[first:last]])
+        y = np.where(min_first, [self.min_y[first:last], self.max_y[first:last]],
+                     [self.max_y[first:last], self.min_y[first:last]])
+        return x.T.ravel(), y.T.ravel()
+
+
+# Min/max decimation pyramid of a whole run, built incrementally: level 0 holds
+# the samples, every bucket of level k + 1 the minimum and maximum of `factor`
+# buckets of level k. window() picks the finest level with no more buckets than
+# the points requested, so the cost of drawing a time range follows the chart
+# width and not the length of the run. Samples must arrive in time order.
+class DecimationPyramid:
+    def __init__(self, factor=4):
+        self.factor = factor
+        self.clear()
+
+    def clear(self):
+        self.levels = [_PyramidLevel()]
+        self.y_min = None
+        self.y_max = None
+
+    def __len__(self):
+        return self.levels[0].count
+
+    @property
+    def x_range(self):
+        samples = self.levels[0]
+        return (samples.start_x[0], samples.start_x[samples.count - 1]) if samples.count else (None, None)
+
+    def append(self, x, y):
+        self.levels[0].append(x, x, y, x, y)
+        self.y_min = y if self.y_min is None else min(self.y_min, y)
+        self.y_max = y if self.y_max is None else max(self.y_max, y)
+
+        level = 0
+        while self.levels[level].count % self.factor == 0:
+            source = self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append(_PyramidLevel())
+
+            start = source.count - self.factor
+            low = start + int(source.min_y[start:source.count].argmin())
+            high = start + int(source.max_y[start:source.count].argmax())
+            self.levels[level + 1].append(source.start_x[start], source.min_x[low], source.min_y[low],
+                                          source.max_x[high], source.max_y[high])
+            level += 1
+
+    def window(self, x_start, x_end, max_points):
+        # (x, y) of the samples between x_start and x_end plus one on each side, at most
+        # about max_points of them
+        samples = self.levels[0]
+        first = max(int(np.searchsorted(samples.start_x[:samples.count], x_start, side='left')) - 1, 0)
+        last = min(int(np.searchsorted(samples.start_x[:samples.count], x_end, side='right')) + 1, samples.count)
+
+        level = 0
+        while (level + 1 < len(self.levels) and
+               (last - first) / self.factor ** level > max(max_points // 2, 1)):
+            level += 1
+
+        parts = []
+        self._gather(level, first, last, parts)
+        if not parts:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate([x for x, _ in parts]), np.concatenate([y for _, y in parts])
+
+    def _gather(self, level, first, last, parts):
+        # Samples [first, last) from the buckets of `level` they fully cover, the
+        # partly covered ends from the finer levels
+        if first >= last:
+            return
+        if level == 0:
+            samples = self.levels[0]
+            parts.append((samples.start_x[first:last], samples.min_y[first:last]))
+            return
+
+        size = self.factor ** level
+        first_bucket = -(-first // size)
+        last_bucket = min(last // size, self.levels[level].count)
+        if first_bucket >= last_bucket:
+            self._gather(level - 1, first, last, parts)
+            return
+
+        self._gather(level - 1, first, first_bucket * size, parts)
+        parts.append(self.levels[level].points(first_bucket, last_bucket))
+        self._gather(level - 1, last_bucket * size, last, parts)
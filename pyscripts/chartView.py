@@ -0,0 +1,63 @@
+from PyQt6.QtCharts import QChartView
+from PyQt6.QtCore import Qt, pyqtSignal
+
+
+# QChartView with horizontal zoom (mouse wheel, around the cursor) and pan (drag
+# with the left button). view is 'live' while following the latest samples,
+# 'full' for the whole run, or an (x_start, x_end) range after zooming or
+# panning. A double click switches between live and the whole run. The owner
+# redraws from its history on viewChanged.
+class ZoomableChartView(QChartView):
+    viewChanged = pyqtSignal()
+
+    def __init__(self, chart, axis_x):
+        QChartView.__init__(self, chart)
+        self.axis_x = axis_x
+        self.view = 'live'
+        self._drag_x = None
+
+    def set_view(self, view):
+        self.view = view
+        self.viewChanged.emit()
+
+    def _current_range(self):
+        return self.axis_x.min(), self.axis_x.max()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps == 0:
+            return
+
+        x_start, x_end = self._current_range()
+        center = self.chart().mapToValue(event.position()).x()
+        scale = 0.8 ** steps
+        self.set_view((center - (center - x_start) * scale, center + (x_end - center) * scale))
+        event.accept()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag_x = event.position().x()
+            event.accept()
+        else:
+            QChartView.mousePressEvent(self, event)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_x is None:
+            QChartView.mouseMoveEvent(self, event)
+            return
+
+        width = self.chart().plotArea().width()
+        if width > 0:
+            x_start, x_end = self._current_range()
+            shift = (self._drag_x - event.position().x()) * (x_end - x_start) / width
+            self.set_view((x_start + shift, x_end + shift))
+        self._drag_x = event.position().x()
+        event.accept()
+
+    def mouseReleaseEvent(self, event):
+        self._drag_x = None
+        QChartView.mouseReleaseEvent(self, event)
+
+    def mouseDoubleClickEvent(self, event):
+        self.set_view('full' if self.view == 'live' else 'live')
+        event.accept()
@@ -0,0 +1,178 @@
+import bisect
+import os
+import threading
+import time
+
+# Histogram bucket upper edges in microseconds, the last bucket takes everything above
+HISTOGRAM_EDGES_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000,
+                      500000, 1000000)
+
+
+class Histogram:
+    def __init__(self, edges_us=HISTOGRAM_EDGES_US):
+        self.edges_us = edges_us
+        self.counts = [0] * (len(edges_us) + 1)
+        self.count = 0
+        self.max_us = 0
+
+    def add(self, value_ns):
+        value_us = value_ns / 1000
+        self.counts[bisect.bisect_left(self.edges_us, value_us)] += 1
+        self.count += 1
+        self.max_us = max(self.max_us, value_us)
+
+    def percentile(self, percent):
+        # Upper edge of the bucket holding the percentile, max_us for the overflow bucket
+        if self.count == 0:
+            return 0
+
+        needed = self.count * percent / 100
+        total = 0
+        for edge, count in zip(self.edges_us, self.counts):
+            total += count
+            if total >= needed:
+                return edge
+        return self.max_us
+
+    def as_dict(self):
+        return {'count': self.count, 'max_us': self.max_us, 'p50_us': self.percentile(50),
+                'p99_us': self.percentile(99), 'edges_us': list(self.edges_us), 'counts': list(self.counts)}
+
+
+# Runs tick(deadline_s) every period_s on a dedicated thread, on a fixed grid of
+# deadlines from a monotonic nanosecond clock. tick gets the deadline it runs for,
+# so consecutive on-time ticks are exactly one period apart whatever the jitter. The thread sleeps until spin_s
+# before the deadline and busy waits the rest, which is what gets sub-millisecond
+# periods right with the coarse sleep of the OS.
+#
+# When a tick overruns, policy 'catch_up' runs the missed ticks back to back (at
+# most max_catch_up of them, the schedule restarts after a longer stall) and
+# 'skip' drops them and waits for the next deadline on the grid.
+#
+# With align the deadlines fall on multiples of the period of the monotonic
+# clock, so loops with the same period tick together, e.g. the batteries sharing
+# an instrument, whose requests then go out in one transaction.
+#
+# Start jitter (start - deadline), tick duration and overrun (duration - period)
+# go into histograms, ticks starting more than late_s after their deadline count
+# as late. Whatever tick returns, other than None, is passed to the subscribers
+# from the loop thread, and the finished subscribers get the error (or None) the
+# loop ended with.
+class ControlLoop:
+    def __init__(self, tick, period_s=0.001, policy='catch_up', spin_s=0.0002, late_s=None, max_catch_up=10,
+                 realtime=False, align=False, name="BatSimControlLoop"):
+        if policy not in ('catch_up', 'skip'):
+            raise ValueError("Unknown control loop policy " + str(policy))
+
+        self.tick = tick
+        self.period_s = period_s
+        self.policy = policy
+        self.spin_s = spin_s
+        self.late_s = period_s if late_s is None else late_s
+        self.max_catch_up = max_catch_up
+        self.realtime = realtime
+        self.align = align
+        self.name = name
+
+        self.subscribers = []
+        self.finished_subscribers = []
+        self.error = None
+        self.reset_stats()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.late = 0
+        self.skipped = 0
+        self.jitter = Histogram()
+        self.duration = Histogram()
+        self.overrun = Histogram()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def subscribe_finished(self, callback):
+        self.finished_subscribers.append(callback)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def request_stop(self):
+        # Safe from the tick itself, the loop ends after the current tick
+        self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        return {'period_s': self.period_s, 'policy': self.policy, 'ticks': self.ticks, 'overruns': self.overruns,
+                'late': self.late, 'skipped': self.skipped, 'jitter': self.jitter.as_dict(),
+                'duration': self.duration.as_dict(), 'overrun': self.overrun.as_dict()}
+
+    def _set_realtime(self):
+        # Needs CAP_SYS_NICE on Linux, the loop runs with normal priority otherwise
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+        except (AttributeError, OSError):
+            pass
+
+    def _wait_until(self, deadline_ns):
+        remaining_s = (deadline_ns - time.perf_counter_ns()) / 1e9 - self.spin_s
+        if remaining_s > 0 and self._stop.wait(remaining_s):
+            return False
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+        return not self._stop.is_set()
+
+    def _run(self):
+        if self.realtime:
+            self._set_realtime()
+
+        period_ns = round(self.period_s * 1e9)
+        late_ns = round(self.late_s * 1e9)
+        deadline_ns = time.perf_counter_ns() + period_ns
+        if self.align:
+            deadline_ns -= deadline_ns % period_ns
+        try:
+            while self._wait_until(deadline_ns):
+                start_ns = time.perf_counter_ns()
+                result = self.tick(deadline_ns / 1e9)
+                end_ns = time.perf_counter_ns()
+
+                self.ticks += 1
+                lateness_ns = start_ns - deadline_ns
+                self.jitter.add(lateness_ns)
+                if lateness_ns > late_ns:
+                    self.late += 1
+                duration_ns = end_ns - start_ns
+                self.duration.add(duration_ns)
+                if duration_ns > period_ns:
+                    self.overruns += 1
+                    self.overrun.add(duration_ns - period_ns)
+
+                if result is not None:
+                    for callback in self.subscribers:
+                        callback(result)
+
+                deadline_ns += period_ns
+                behind = (time.perf_counter_ns() - deadline_ns) // period_ns
+                if behind > 0 and (self.policy == 'skip' or behind > self.max_catch_up):
+                    self.skipped += behind
+                    deadline_ns += behind * period_ns
+        except Exception as error:
+            # kept for the owner, e.g. a lost instrument connection
+            self.error = error
+        finally:
+            for callback in self.finished_subscribers:
+                callback(self.error)
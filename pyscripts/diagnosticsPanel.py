@@ -0,0 +1,77 @@
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QHeaderView, QLabel, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget
+from tickProfiler import TICK_STAGES
+
+# Columns of the stage table: header, key in TickProfiler.stats()
+DIAGNOSTICS_COLUMNS = (('Mean (us)', 'mean_us'), ('p50 (us)', 'p50_us'), ('p90 (us)', 'p90_us'),
+                       ('p99 (us)', 'p99_us'), ('Max (us)', 'max_us'))
+
+
+# Where the tick time of a BatSimCore goes: rolling percentiles of every tick
+# stage, the control loop counters and the startup times, refreshed once a
+# second. The core is profiled while the panel is shown.
+class DiagnosticsPanel(QWidget):
+    def __init__(self, core, startup=None, parent=None):
+        QWidget.__init__(self, parent, Qt.WindowType.Window)
+        self.setWindowTitle("Battery Simulator Diagnostics")
+        self.core = core
+        self.startup = startup
+        self._profiling = False
+
+        rows = TICK_STAGES + ('total',)
+        self.table = QTableWidget(len(rows), len(DIAGNOSTICS_COLUMNS))
+        self.table.setHorizontalHeaderLabels([header for header, _ in DIAGNOSTICS_COLUMNS])
+        self.table.setVerticalHeaderLabels(list(rows))
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        for row in range(len(rows)):
+            for column in range(len(DIAGNOSTICS_COLUMNS)):
+                item = QTableWidgetItem('')
+                item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+        self.loop_label = QLabel()
+        self.startup_label = QLabel()
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addWidget(self.loop_label)
+        layout.addWidget(self.startup_label)
+        self.resize(560, 360)
+
+        self.timer = QTimer()
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        # profiling someone else enabled is left alone
+        if self.core.profiler is None:
+            self.core.enable_profiling()
+            self._profiling = True
+        self.timer.start()
+        self.refresh()
+        QWidget.showEvent(self, event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        if self._profiling:
+            self.core.disable_profiling()
+            self._profiling = False
+        QWidget.hideEvent(self, event)
+
+    def refresh(self):
+        stats = self.core.tick_stats()
+        for row, stage in enumerate(TICK_STAGES + ('total',)):
+            values = stats.get(stage)
+            for column, (_, key) in enumerate(DIAGNOSTICS_COLUMNS):
+                self.table.item(row, column).setText(f"{values[key]:.1f}" if values else '')
+
+        loop = self.core.control_loop
+        if loop is None:
+            self.loop_label.setText("Control loop not started")
+        else:
+            self.loop_label.setText(f"Ticks {loop.ticks}, overruns {loop.overruns}, late {loop.late}, "
+                                    f"skipped {loop.skipped}, start jitter p99 {loop.jitter.percentile(99)} us, "
+                                    f"tick duration p99 {loop.duration.percentile(99)} us")
+
+        if self.startup is not None:
+            self.startup_label.setText("Startup: " + self.startup.report())
@@ -0,0 +1,221 @@
+import asyncio
+import time
+from BatSimHardware import BatSimHw
+from scpiInstrument import InstrumentLoop, Keithley2308, LatencyStats, ScpiInstrument, open_transport
+
+
+# One channel of a shared instrument, with the interface of Keithley2308, so a
+# BatSimHw drives it like a dedicated instrument
+class MultiplexedChannel:
+    def __init__(self, multiplexer, channel):
+        self.multiplexer = multiplexer
+        self.channel = channel
+        self.suffix = '' if channel == 1 else str(channel)
+        self.connected = False
+        self.volts = None
+        self.set_waiters = []
+        self.measure_waiters = []
+
+    def has_work(self):
+        return self.volts is not None or bool(self.measure_waiters)
+
+    def pending_commands(self):
+        return (self.volts is not None) + bool(self.measure_waiters)
+
+    async def connect(self):
+        await self.multiplexer.connect()
+        self.connected = True
+
+    async def close(self):
+        self.connected = False
+        await self.multiplexer.close()
+
+    async def measure_ibatt_ma(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self.measure_waiters.append(waiter)
+        self.multiplexer.schedule()
+        return await waiter
+
+    async def set_vbatt_mv(self, vbatt_mv):
+        # only the latest voltage not yet sent goes out
+        self.volts = vbatt_mv / 1000
+        waiter = asyncio.get_running_loop().create_future()
+        self.set_waiters.append(waiter)
+        self.multiplexer.schedule()
+        await waiter
+
+
+# Serves several channels of one instrument over a single connection. Requests
+# of all channels are collected and sent as one ';' joined SCPI message, with a
+# single transaction in flight: whatever arrives during a round trip goes out
+# together in the next one, so N channels ticking together cost about one round
+# trip per tick. Several measurements of a channel share one query and only its
+# latest voltage is set.
+#
+# Before a message goes out, the multiplexer waits until every connected channel
+# has a request, so channels ticking together (see ControlLoop align) share one
+# message, but at most batch_window_s: a channel that is not ticking only delays
+# the others by that much. It should stay well below the control period.
+#
+# A message holds at most max_commands commands. When more is pending, channels
+# are served round robin from the one after the last channel served, so no
+# channel is starved.
+class InstrumentMultiplexer:
+    def __init__(self, scpi, channels, max_commands=32, batch_window_s=0.001, driver=Keithley2308):
+        self.scpi = scpi
+        self.channels = {channel: MultiplexedChannel(self, channel) for channel in channels}
+        self.max_commands = max_commands
+        self.batch_window_s = batch_window_s
+        self.driver = driver
+
+        self.transactions = 0
+        self.commands = 0
+        self.latency = LatencyStats()
+        self._order = list(self.channels.values())
+        self._next = 0
+        self._flush = None
+        self._arrived = asyncio.Event()
+        self._users = 0
+
+    def channel(self, channel):
+        return self.channels[channel]
+
+    async def connect(self):
+        if self._users == 0:
+            await self.scpi.connect()
+        self._users += 1
+
+    async def close(self):
+        self._users -= 1
+        if self._users == 0:
+            await self.scpi.close()
+
+    def schedule(self):
+        self._arrived.set()
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._run())
+
+    async def _wait_for_channels(self):
+        # Until every connected channel has a request, a message is full, or batch_window_s has passed
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window_s
+        while not all(channel.has_work() for channel in self._order if channel.connected):
+            if sum(channel.pending_commands() for channel in self._order) >= self.max_commands:
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def _collect(self):
+        batch = []
+        used = 0
+        served = None
+        for i in range(len(self._order)):
+            index = (self._next + i) % len(self._order)
+            channel = self._order[index]
+            if not channel.has_work():
+                continue
+
+            size = channel.pending_commands()
+            if used + size > self.max_commands:
+                break
+
+            batch.append((channel, channel.volts, channel.set_waiters, channel.measure_waiters))
+            channel.volts = None
+            channel.set_waiters = []
+            channel.measure_waiters = []
+            used += size
+            served = index
+
+        if served is not None:
+            self._next = (served + 1) % len(self._order)
+        return batch
+
+    async def _run(self):
+        try:
+            # lets requests submitted together join the first message
+            await asyncio.sleep(0)
+
+            while True:
+                await self._wait_for_channels()
+                batch = self._collect()
+                if not batch:
+                    return
+                await self._transact(batch)
+        finally:
+            self._flush = None
+
+    async def _transact(self, batch):
+        commands = []
+        measured = []
+        for channel, volts, set_waiters, measure_waiters in batch:
+            if volts is not None:
+                commands.append(self.driver.SET_VOLTAGE.format(channel=channel.suffix, volts=volts))
+            if measure_waiters:
+                commands.append(self.driver.MEASURE_CURRENT.format(channel=channel.suffix))
+                measured.append(measure_waiters)
+
+        if not measured:
+            # a message of sets only is confirmed with *OPC?
+            commands.append('*OPC?')
+
+        start = time.perf_counter()
+        try:
+            responses = (await self.scpi.query(';'.join(commands))).split(';')
+            if measured and len(responses) != len(measured):
+                raise ValueError("Unexpected instrument response " + ';'.join(responses))
+        except Exception as error:
+            for _, _, set_waiters, measure_waiters in batch:
+                for waiter in set_waiters + measure_waiters:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+            return
+
+        self.transactions += 1
+        self.commands += len(commands)
+        self.latency.add(time.perf_counter() - start)
+
+        for _, _, set_waiters, _ in batch:
+            for waiter in set_waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        for waiters, response in zip(measured, responses):
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(float(response) * 1000)
+
+
+# Shares one connection per instrument address between the batteries of a rack,
+# all on one instrument event loop.
+class InstrumentPool:
+    def __init__(self, timeout_s=1.0, retries=2, max_commands=32, batch_window_s=0.001):
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.max_commands = max_commands
+        self.batch_window_s = batch_window_s
+        self.loop = InstrumentLoop()
+        self.multiplexers = {}
+        self.hardware = []
+
+    def multiplexer(self, address, channels=range(1, 9)):
+        if address not in self.multiplexers:
+            scpi = ScpiInstrument(open_transport(address), self.timeout_s, self.retries)
+            self.multiplexers[address] = InstrumentMultiplexer(scpi, channels, self.max_commands,
+                                                               self.batch_window_s)
+        return self.multiplexers[address]
+
+    def batsim_hw(self, address, channel, prefetch=True):
+        hw = BatSimHw(self.multiplexer(address).channel(channel), prefetch, self.loop)
+        self.hardware.append(hw)
+        return hw
+
+    def close(self):
+        for hw in self.hardware:
+            hw.close()
+        self.hardware = []
+        self.loop.close()
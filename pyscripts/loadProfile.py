@@ -0,0 +1,127 @@
+import math
+import time
+import numpy as np
+
+
+# A load profile is any iterable of (time_s, ibatt_mA) breakpoints. The current
+# of a row is drawn from its timestamp until the timestamp of the next row, the
+# last row only marks the end of the trace. The readers below stream the rows,
+# so a trace with millions of breakpoints never has to fit in a Python list.
+
+# One CSV row per breakpoint, "time_s, ibatt_mA". Header and comment lines are skipped.
+class CsvLoadProfile:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __iter__(self):
+        with open(self.filename, 'r') as file:
+            for line in file:
+                fields = line.split(',')
+                if len(fields) < 2:
+                    continue
+                try:
+                    yield float(fields[0]), float(fields[1])
+                except ValueError:
+                    continue
+
+
+# Packed little-endian float64 (time_s, ibatt_mA) records, memory-mapped and read in chunks.
+class BinaryLoadProfile:
+    dtype = np.dtype([('time_s', '<f8'), ('ibatt_mA', '<f8')])
+    chunk_rows = 65536
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = np.memmap(filename, dtype=self.dtype, mode='r')
+
+    def __len__(self):
+        return len(self.data)
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of receiving a copy of it
+        return BinaryLoadProfile, (self.filename,)
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.chunk_rows):
+            chunk = self.data[start:start + self.chunk_rows]
+            yield from zip(chunk['time_s'].tolist(), chunk['ibatt_mA'].tolist())
+
+    @classmethod
+    def write(cls, filename, rows):
+        # rows is any iterable of (time_s, ibatt_mA), e.g. a CsvLoadProfile to convert it
+        buffer = np.empty(cls.chunk_rows, dtype=cls.dtype)
+        count = 0
+        with open(filename, 'wb') as file:
+            for time_s, ibatt_mA in rows:
+                buffer[count] = (time_s, ibatt_mA)
+                count += 1
+                if count == cls.chunk_rows:
+                    file.write(buffer.tobytes())
+                    count = 0
+            file.write(buffer[:count].tobytes())
+
+
+def open_load_profile(filename):
+    if filename.lower().endswith('.csv'):
+        return CsvLoadProfile(filename)
+
+    return BinaryLoadProfile(filename)
+
+
+def load_profile_segments(profile):
+    # (start_s, end_s, ibatt_mA) of every constant current segment
+    previous = None
+    for time_s, ibatt_mA in profile:
+        if previous is not None:
+            if time_s < previous[0]:
+                raise ValueError("Load profile timestamps must not decrease")
+            if time_s > previous[0]:
+                yield previous[0], time_s, previous[1]
+        previous = (time_s, ibatt_mA)
+
+
+def load_profile_steps(profile, max_dt_s=None):
+    # (dt_s, ibatt_mA) steps landing exactly on every breakpoint of the profile.
+    # Segments longer than max_dt_s are split into equal steps.
+    for start_s, end_s, ibatt_mA in load_profile_segments(profile):
+        duration_s = end_s - start_s
+        if max_dt_s is None or duration_s <= max_dt_s:
+            yield duration_s, ibatt_mA
+        else:
+            count = math.ceil(duration_s / max_dt_s)
+            dt_s = duration_s / count
+            for _ in range(count):
+                yield dt_s, ibatt_mA
+
+
+# Replays a profile against the wall clock, for the simulated hardware.
+# Only moves forward through the profile, so the trace is still streamed.
+class LoadProfileCursor:
+    def __init__(self, profile):
+        self._segments = load_profile_segments(profile)
+        self._offset_s = None
+        self._segment = None
+        self.finished = False
+        self.start_time = None
+
+    def current_at(self, elapsed_s):
+        # Current of the segment containing elapsed_s, counted from the first breakpoint.
+        # 0 mA once the profile is over.
+        while not self.finished:
+            if self._segment is not None and elapsed_s < self._segment[1] - self._offset_s:
+                return self._segment[2]
+
+            self._segment = next(self._segments, None)
+            if self._segment is None:
+                self.finished = True
+            elif self._offset_s is None:
+                self._offset_s = self._segment[0]
+
+        return 0
+
+    def current_now(self):
+        # The clock starts with the first measurement
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+        return self.current_at(time.perf_counter() - self.start_time)
@@ -0,0 +1,171 @@
+import argparse
+import gzip
+import json
+import os
+import struct
+import numpy as np
+from Logger import BINARY_MAGIC, CSV_HEADER, INDEX_DTYPE, INDEX_SUFFIX, LOG_FIELDS, binary_record_dtype, \
+    format_csv_line
+
+
+# Sparse (time, byte offset) index written by BatSimLogger next to the log.
+# Logs without one are treated as a single indexed block starting at data_offset.
+class LogIndex:
+    def __init__(self, filename, data_offset):
+        self.filename = filename + INDEX_SUFFIX
+        self.data_offset = data_offset
+        self.entries = np.zeros(0, dtype=INDEX_DTYPE)
+        self.refresh()
+
+    def refresh(self):
+        if os.path.exists(self.filename):
+            # a live writer may be halfway through an entry, only whole ones are read
+            count = os.path.getsize(self.filename) // INDEX_DTYPE.itemsize
+            self.entries = np.fromfile(self.filename, dtype=INDEX_DTYPE, count=count)
+
+        return len(self.entries)
+
+    def byte_range(self, start_time, end_time):
+        # Smallest indexed byte range holding every record in [start_time, end_time],
+        # the end is None when the range runs to the end of the log
+        times = self.entries['time']
+        first = int(np.searchsorted(times, start_time, side='left')) - 1
+        last = int(np.searchsorted(times, end_time, side='right'))
+        start = int(self.entries['offset'][first]) if first >= 0 else self.data_offset
+        end = int(self.entries['offset'][last]) if last < len(times) else None
+        return start, end
+
+
+def _open(filename):
+    # Rotated segments are gzipped, seeking in them decompresses up to the offset
+    return gzip.open(filename, 'rb') if filename.endswith('.gz') else open(filename, 'rb')
+
+
+def _select(columns, start_time, end_time, max_points):
+    # Trims the columns to the window and keeps at most max_points evenly strided samples
+    times = columns[LOG_FIELDS[0]]
+    first = int(np.searchsorted(times, start_time, side='left'))
+    last = int(np.searchsorted(times, end_time, side='right'))
+    step = 1
+    if max_points is not None and last - first > max_points:
+        step = -(-(last - first) // max_points)
+
+    return {name: column[first:last:step] for name, column in columns.items()}
+
+
+# Zero-copy access to a binary log written by BatSimLogger. records is a
+# numpy.memmap of the packed records, so opening a multi-day log is instant and
+# only the pages actually read are loaded. Logs still being written can be
+# refresh()ed to see the records appended since.
+class BinaryLog:
+    def __init__(self, filename):
+        self.filename = filename
+        with _open(filename) as file:
+            if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise ValueError(filename + " is not a binary batsim log")
+            self.header_size = struct.unpack('<I', file.read(4))[0]
+            self.header = json.loads(file.read(self.header_size - len(BINARY_MAGIC) - 4))
+
+        self.parameters = self.header['parameters']
+        self.dtype = binary_record_dtype(self.header['value_dtype'])
+        self.records = None
+        self.index = LogIndex(filename, self.header_size)
+        self.refresh()
+
+    def refresh(self):
+        self.index.refresh()
+        if self.filename.endswith('.gz'):
+            # compressed segments are complete, they are read into memory once
+            if self.records is None:
+                with gzip.open(self.filename, 'rb') as file:
+                    data = file.read()[self.header_size:]
+                self.records = np.frombuffer(data, dtype=self.dtype, count=len(data) // self.dtype.itemsize)
+            return len(self.records)
+
+        count = (os.path.getsize(self.filename) - self.header_size) // self.dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.header_size,
+                                     shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+        return count
+
+    def __len__(self):
+        return len(self.records)
+
+    def column(self, name):
+        return self.records[name]
+
+    @property
+    def start_time(self):
+        return float(self.records['time'][0]) if len(self.records) else None
+
+    def window(self, start_time, end_time, max_points=None):
+        # {field: array} of the records logged between start_time and end_time (epoch
+        # seconds), views into the memmap. The index narrows the search, so only the
+        # pages of the window itself are touched.
+        start, end = self.index.byte_range(start_time, end_time)
+        first = (start - self.header_size) // self.dtype.itemsize
+        last = len(self.records) if end is None else min((end - self.header_size) // self.dtype.itemsize,
+                                                         len(self.records))
+        records = self.records[first:last]
+        return _select({name: records[name] for name in LOG_FIELDS}, start_time, end_time, max_points)
+
+    def to_csv(self, filename, chunk_rows=65536):
+        # Same layout as the CSV written by BatSimLogger, converted chunk by chunk
+        with open(filename, 'w') as file:
+            file.write(CSV_HEADER)
+            for start in range(0, len(self.records), chunk_rows):
+                file.write(''.join(format_csv_line(record)
+                                   for record in self.records[start:start + chunk_rows].tolist()))
+
+
+# Windowed access to a CSV log written by BatSimLogger. Only the byte range the
+# index points at is read and parsed, so the cost follows the window, not the log.
+class CsvLog:
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = LogIndex(filename, len(CSV_HEADER.encode()))
+
+    def refresh(self):
+        return self.index.refresh()
+
+    @property
+    def start_time(self):
+        with _open(self.filename) as file:
+            file.seek(self.index.data_offset)
+            line = file.readline()
+        return float(line.split(b',')[0]) if line.endswith(b'\n') else None
+
+    def window(self, start_time, end_time, max_points=None):
+        start, end = self.index.byte_range(start_time, end_time)
+        with _open(self.filename) as file:
+            file.seek(start)
+            data = file.read() if end is None else file.read(end - start)
+
+        # a live log may end with a line still being written
+        data = data[:data.rfind(b'\n') + 1]
+        rows = np.loadtxt(data.decode().splitlines(), delimiter=',', ndmin=2) if data else \
+            np.zeros((0, len(LOG_FIELDS)))
+        return _select({name: rows[:, i] for i, name in enumerate(LOG_FIELDS)}, start_time, end_time, max_points)
+
+
+def open_log(filename):
+    # BinaryLog or CsvLog, depending on the file contents
+    with _open(filename) as file:
+        binary = file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    return BinaryLog(filename) if binary else CsvLog(filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a binary batsim log to CSV")
+    parser.add_argument('log', help="binary log written by BatSimLogger")
+    parser.add_argument('csv', help="CSV file to write")
+    args = parser.parse_args(argv)
+
+    BinaryLog(args.log).to_csv(args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,22 @@
+import time
+startup_start = time.perf_counter()
+
+import argparse
+import logging
 from batteryGuiHandler import BatSimGuiHandler
+from BatSimHardware import BatSimHw
+
+# python main.py [tcp://host:port | serial:///dev/ttyUSB0?baudrate=9600] [--log-level info]
+parser = argparse.ArgumentParser(description="Battery simulator")
+parser.add_argument('instrument', nargs='?', help="instrument address, the load is simulated without")
+parser.add_argument('--log-level', default='warning', choices=('debug', 'info', 'warning', 'error'))
+args = parser.parse_args()
+logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+batsimHw = None
+if args.instrument:
+    from scpiInstrument import open_instrument
+    batsimHw = BatSimHw(open_instrument(args.instrument))
 
-batsim = BatSimGuiHandler()
+batsim = BatSimGuiHandler(batsimHw, startup_start)
 batsim.start()
@@ -0,0 +1,124 @@
+import bisect
+
+
+# Uniform bucket index over a strictly increasing list of breakpoints.
+# Bucket i holds the segment containing the start of the bucket, so finding
+# the segment of a value is O(1) no matter how many breakpoints there are.
+class BreakpointIndex:
+    def __init__(self, breakpoints):
+        if len(breakpoints) < 2:
+            raise ValueError("Table needs at least two breakpoints")
+
+        self.breakpoints = [float(breakpoint) for breakpoint in breakpoints]
+
+        if any(b1 <= b0 for b0, b1 in zip(self.breakpoints, self.breakpoints[1:])):
+            raise ValueError("Table breakpoints must be strictly increasing")
+
+        self.minimum = self.breakpoints[0]
+        self.maximum = self.breakpoints[-1]
+        self._last_segment = len(self.breakpoints) - 2
+        self._bucket_count = 4 * (len(self.breakpoints) - 1)
+        self._bucket_width = (self.maximum - self.minimum) / self._bucket_count
+        self._buckets = [min(bisect.bisect_right(self.breakpoints, self.minimum + i * self._bucket_width) - 1,
+                             self._last_segment)
+                         for i in range(self._bucket_count + 1)]
+
+    def segment(self, value):
+        bucket = int((value - self.minimum) / self._bucket_width)
+        if bucket < 0:
+            return 0
+        if bucket > self._bucket_count:
+            return self._last_segment
+
+        segment = self._buckets[bucket]
+        while segment < self._last_segment and value >= self.breakpoints[segment + 1]:
+            segment += 1
+
+        return segment
+
+    def locate(self, value):
+        # Segment and position inside of it, clamped to the ends of the table
+        if value <= self.minimum:
+            return 0, 0.0
+        if value >= self.maximum:
+            return self._last_segment, 1.0
+
+        segment = self.segment(value)
+        b0 = self.breakpoints[segment]
+        return segment, (value - b0) / (self.breakpoints[segment + 1] - b0)
+
+
+# Piecewise linear OCV curve over any number of (SoC %, OCV mV) breakpoints.
+# Segment slopes are computed once, and a BreakpointIndex over the SoC axis
+# maps every lookup to its segment in O(1), so the per-tick cost does not
+# grow with the table size. soc() does the inverse lookup, voltage to SoC.
+class OcvTable:
+    def __init__(self, soc_percent, ocv_mv):
+        if len(soc_percent) != len(ocv_mv):
+            raise ValueError("OCV table needs as many SoC breakpoints as voltages")
+
+        self.index = BreakpointIndex(soc_percent)
+        self.soc_percent = self.index.breakpoints
+        self.ocv_mv = [float(ocv) for ocv in ocv_mv]
+
+        self._slopes = [(ocv1 - ocv0) / (soc1 - soc0) for soc0, soc1, ocv0, ocv1 in
+                        zip(self.soc_percent, self.soc_percent[1:], self.ocv_mv, self.ocv_mv[1:])]
+        self._soc_min = self.index.minimum
+        self._soc_max = self.index.maximum
+
+        # The inverse lookup only makes sense for a curve that never decreases
+        self.monotonic = all(slope >= 0 for slope in self._slopes)
+
+    @classmethod
+    def from_list(cls, ocv_mv):
+        # Evenly spaced table from 0% to 100%, e.g. the 101 entry table of the GUI
+        count = len(ocv_mv)
+        if count < 2:
+            raise ValueError("OCV table needs at least two breakpoints")
+
+        return cls([100 * i / (count - 1) for i in range(count)], ocv_mv)
+
+    @classmethod
+    def from_csv(cls, filename):
+        # One "soc_percent, ocv_mv" pair per line, lines that do not parse (headers, comments) are skipped
+        soc_percent = []
+        ocv_mv = []
+        with open(filename, 'r') as file:
+            for line in file:
+                fields = line.replace(';', ',').split(',')
+                if len(fields) < 2:
+                    continue
+                try:
+                    soc, ocv = float(fields[0]), float(fields[1])
+                except ValueError:
+                    continue
+                soc_percent.append(soc)
+                ocv_mv.append(ocv)
+
+        return cls(soc_percent, ocv_mv)
+
+    def __len__(self):
+        return len(self.soc_percent)
+
+    def ocv(self, soc_percent):
+        # Outside of the table the curve is clamped to its first and last voltage
+        if soc_percent <= self._soc_min:
+            return self.ocv_mv[0]
+        if soc_percent >= self._soc_max:
+            return self.ocv_mv[-1]
+
+        segment = self.index.segment(soc_percent)
+        return self.ocv_mv[segment] + self._slopes[segment] * (soc_percent - self.soc_percent[segment])
+
+    def soc(self, ocv_mv):
+        if not self.monotonic:
+            raise ValueError("Inverse OCV lookup needs a non-decreasing OCV table")
+
+        if ocv_mv <= self.ocv_mv[0]:
+            return self.soc_percent[0]
+        if ocv_mv >= self.ocv_mv[-1]:
+            return self.soc_percent[-1]
+
+        # first segment whose end voltage reaches ocv_mv, so its slope is never zero
+        segment = bisect.bisect_left(self.ocv_mv, ocv_mv) - 1
+        return self.soc_percent[segment] + (ocv_mv - self.ocv_mv[segment]) / self._slopes[segment]
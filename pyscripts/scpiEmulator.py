@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import collections
+import re
+import time
+
+_SOURCE_VOLTAGE = re.compile(r'SOUR(?:CE)?(\d*):VOLT(?:AGE)?(?::LEV(?:EL)?)?(\?|\s+(\S+))$')
+_MEASURE = re.compile(r'(?:MEAS(?:URE)?|READ)(\d*):(CURR(?:ENT)?|VOLT(?:AGE)?)\?$')
+_SYSTEM_ERROR = re.compile(r'SYST(?:EM)?:ERR(?:OR)?(?::NEXT)?\?$')
+
+UNDEFINED_HEADER = '-113,"Undefined header"'
+SUFFIX_OUT_OF_RANGE = '-114,"Header suffix out of range"'
+DATA_TYPE_ERROR = '-104,"Data type error"'
+NO_ERROR = '0,"No error"'
+
+
+# Local stand-in for a Keithley 2308 style battery simulator, so the whole SCPI
+# path can run without hardware. Every channel has an output voltage and a load
+# in mA; the measured current is load_mA, or follows the set voltage through
+# load_ohms when that is given.
+#
+# Responses leave latency_s after their command arrived, in order, like a link
+# with that round trip time: pipelined commands overlap, back to back ones add up.
+# drop_responses makes the next responses go missing, to exercise timeouts.
+#
+# Rejected commands (unknown header, channel out of range, bad number) go to the
+# error queue read by SYST:ERR?, and a rejected query answers with the error
+# instead of a value, so the responses stay in step with the queries.
+class ScpiEmulator:
+    def __init__(self, host='127.0.0.1', port=0, latency_s=0.0, channels=2, load_mA=100, load_ohms=None):
+        self.host = host
+        self.port = port
+        self.latency_s = latency_s
+        self.voltage_v = [0.0] * channels
+        self.load_mA = [load_mA] * channels
+        self.load_ohms = load_ohms
+        self.drop_responses = 0
+        self.errors = collections.deque(maxlen=32)
+        self.commands = 0
+        self.messages = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def current_a(self, channel):
+        if self.load_ohms:
+            return self.voltage_v[channel] / self.load_ohms
+        return self.load_mA[channel] / 1000
+
+    def execute(self, message):
+        # Runs one line of ';' separated commands, returns the joined query responses or None
+        self.messages += 1
+        responses = []
+        for command in message.split(';'):
+            command = command.strip().lstrip(':').upper()
+            if not command:
+                continue
+            self.commands += 1
+
+            try:
+                response = self._command(command)
+            except IndexError:
+                response = self._error(SUFFIX_OUT_OF_RANGE, command)
+            except ValueError:
+                response = self._error(DATA_TYPE_ERROR, command)
+            if response is not None:
+                responses.append(response)
+
+        return ';'.join(responses) if responses else None
+
+    def _error(self, error, command):
+        self.errors.append(error)
+        return error if command.endswith('?') else None
+
+    def _channel(self, suffix):
+        channel = int(suffix or 1) - 1
+        if not 0 <= channel < len(self.voltage_v):
+            raise IndexError(suffix)
+        return channel
+
+    def _command(self, command):
+        source = _SOURCE_VOLTAGE.match(command)
+        measure = _MEASURE.match(command)
+        if command == '*IDN?':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 2308,EMULATED,1.0'
+        if command == '*OPC?':
+            return '1'
+        if command in ('*CLS', '*RST'):
+            self.errors.clear()
+            if command == '*RST':
+                self.voltage_v = [0.0] * len(self.voltage_v)
+            return None
+        if _SYSTEM_ERROR.match(command):
+            return self.errors.popleft() if self.errors else NO_ERROR
+        if source:
+            channel = self._channel(source.group(1))
+            if source.group(2) == '?':
+                return f'{self.voltage_v[channel]:.4f}'
+            self.voltage_v[channel] = float(source.group(3))
+            return None
+        if measure:
+            channel = self._channel(measure.group(1))
+            if measure.group(2).startswith('CURR'):
+                return f'{self.current_a(channel):.6f}'
+            return f'{self.voltage_v[channel]:.4f}'
+
+        return self._error(UNDEFINED_HEADER, command)
+
+    async def _serve(self, reader, writer):
+        outgoing = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send(outgoing, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                response = self.execute(line.decode())
+                if response is None:
+                    continue
+                if self.drop_responses > 0:
+                    self.drop_responses -= 1
+                    continue
+                outgoing.put_nowait((time.monotonic() + self.latency_s, response))
+        except ConnectionError:
+            pass
+        finally:
+            sender.cancel()
+            writer.close()
+
+    async def _send(self, outgoing, writer):
+        while True:
+            due, response = await outgoing.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            writer.write((response + '\n').encode())
+
+
+async def _serve_forever(emulator):
+    port = await emulator.start()
+    print(f"SCPI emulator listening on {emulator.host}:{port}")
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulated Keithley 2308 SCPI battery simulator over TCP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5025)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--channels', type=int, default=8, help="8 like the channels of an InstrumentPool")
+    parser.add_argument('--load-ma', type=float, default=100)
+    parser.add_argument('--load-ohms', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    emulator = ScpiEmulator(args.host, args.port, args.latency_ms / 1000, args.channels, load_mA=args.load_ma,
+                            load_ohms=args.load_ohms)
+    try:
+        asyncio.run(_serve_forever(emulator))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
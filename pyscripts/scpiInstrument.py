@@ -0,0 +1,264 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+class ScpiError(Exception):
+    pass
+
+
+class TcpTransport:
+    def __init__(self, host, port=5025):
+        self.host = host
+        self.port = port
+
+    async def open(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+
+# Serial ports are opened as raw POSIX ttys and driven by the event loop like pipes,
+# so no serial package is needed
+class SerialTransport:
+    def __init__(self, device, baudrate=9600):
+        self.device = device
+        self.baudrate = baudrate
+
+    async def open(self):
+        import termios
+        import tty
+
+        fd = os.open(self.device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        speed = getattr(termios, 'B' + str(self.baudrate))
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', 0))
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                            os.fdopen(os.dup(fd), 'wb', 0))
+        return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+def open_transport(address):
+    # tcp://host[:port] or serial:///dev/ttyUSB0[?baudrate=9600]
+    url = urlparse(address)
+    if url.scheme == 'tcp':
+        return TcpTransport(url.hostname, url.port or 5025)
+    if url.scheme == 'serial':
+        return SerialTransport(url.path, int(parse_qs(url.query).get('baudrate', ['9600'])[0]))
+
+    raise ValueError("Unknown instrument address " + address)
+
+
+class LatencyStats:
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.min_s = None
+        self.max_s = 0.0
+        self.last_s = 0.0
+
+    def add(self, latency_s):
+        self.count += 1
+        self.total_s += latency_s
+        self.min_s = latency_s if self.min_s is None else min(self.min_s, latency_s)
+        self.max_s = max(self.max_s, latency_s)
+        self.last_s = latency_s
+
+    @property
+    def mean_s(self):
+        return self.total_s / self.count if self.count else 0.0
+
+
+# One SCPI connection. Commands are written as soon as they are issued, without
+# waiting for the responses of earlier ones, and SCPI answers queries in order,
+# so responses are matched to the pending queries first in, first out.
+#
+# A query that times out leaves the response stream out of step, so the
+# connection is reopened, every pending query fails over to a retry, and the
+# command is sent again up to `retries` times. Latency from write to response
+# is kept per command header in `latency`.
+class ScpiInstrument:
+    def __init__(self, transport, timeout_s=1.0, retries=2, terminator='\n'):
+        self.transport = transport
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.terminator = terminator
+
+        self.latency = {}
+        self.timeouts = 0
+        self.retried = 0
+
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._pending = collections.deque()
+        self._generation = 0
+        self._connect_lock = None
+
+    async def connect(self):
+        await self._reconnect(self._generation)
+
+    async def close(self):
+        self._disconnect(ConnectionError("Instrument connection closed"))
+
+    async def query(self, command):
+        return await self._execute(command, True)
+
+    async def write(self, command):
+        await self._execute(command, False)
+
+    def latency_report(self):
+        return {command: {'count': stats.count, 'mean_ms': stats.mean_s * 1e3, 'min_ms': stats.min_s * 1e3,
+                          'max_ms': stats.max_s * 1e3, 'last_ms': stats.last_s * 1e3}
+                for command, stats in self.latency.items()}
+
+    def _disconnect(self, error):
+        self._generation += 1
+        if self._receiver is not None:
+            self._receiver.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = self._receiver = None
+
+        while self._pending:
+            response = self._pending.popleft()
+            if not response.done():
+                response.set_exception(error)
+
+    async def _reconnect(self, generation):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            # another command already reopened the connection
+            if generation != self._generation and self._writer is not None:
+                return
+
+            self._disconnect(ConnectionError("Instrument connection reset"))
+            self._reader, self._writer = await asyncio.wait_for(self.transport.open(), self.timeout_s)
+            self._receiver = asyncio.ensure_future(self._receive(self._reader, self._generation))
+
+    async def _receive(self, reader, generation):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Instrument closed the connection")
+
+                # a query that timed out still owns its slot, its late answer is dropped
+                if self._pending:
+                    response = self._pending.popleft()
+                    if not response.done():
+                        response.set_result(line.decode().strip())
+        except (ConnectionError, OSError) as error:
+            if generation == self._generation:
+                self._disconnect(error)
+
+    async def _execute(self, command, expects_response):
+        header = command.split(' ')[0]
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+
+            generation = self._generation
+            try:
+                if self._writer is None:
+                    await self._reconnect(generation)
+                    generation = self._generation
+
+                start = time.perf_counter()
+                response = None
+                if expects_response:
+                    response = asyncio.get_running_loop().create_future()
+                    self._pending.append(response)
+                self._writer.write((command + self.terminator).encode())
+
+                if expects_response:
+                    result = await asyncio.wait_for(response, self.timeout_s)
+                else:
+                    await asyncio.wait_for(self._writer.drain(), self.timeout_s)
+                    result = None
+
+                self.latency.setdefault(header, LatencyStats()).add(time.perf_counter() - start)
+                return result
+            except asyncio.TimeoutError as timeout:
+                self.timeouts += 1
+                error = timeout
+                try:
+                    await self._reconnect(generation)
+                except (asyncio.TimeoutError, OSError):
+                    pass
+            except (ConnectionError, OSError) as connection_error:
+                error = connection_error
+
+        raise ScpiError(f"{command}: no response after {self.retries + 1} attempts") from error
+
+
+# Keithley 2308 battery simulator channel. Voltages are set in V and currents
+# read in A, positive when the simulated battery is discharged.
+class Keithley2308:
+    SET_VOLTAGE = ':SOUR{channel}:VOLT {volts:.4f}'
+    MEASURE_CURRENT = ':MEAS{channel}:CURR?'
+
+    def __init__(self, scpi, channel=1, confirm=True):
+        self.scpi = scpi
+        # channel 1 is addressed without a suffix
+        self.channel = '' if channel == 1 else str(channel)
+        # with confirm every set is followed by *OPC? in the same message, so a
+        # lost or rejected set is detected and the latency covers the device
+        self.confirm = confirm
+
+    async def connect(self):
+        await self.scpi.connect()
+
+    async def close(self):
+        await self.scpi.close()
+
+    async def measure_ibatt_ma(self):
+        return float(await self.scpi.query(self.MEASURE_CURRENT.format(channel=self.channel))) * 1000
+
+    async def set_vbatt_mv(self, vbatt_mv):
+        command = self.SET_VOLTAGE.format(channel=self.channel, volts=vbatt_mv / 1000)
+        if self.confirm:
+            await self.scpi.query(command + ';*OPC?')
+        else:
+            await self.scpi.write(command)
+
+
+def open_instrument(address, channel=1, timeout_s=1.0, retries=2):
+    return Keithley2308(ScpiInstrument(open_transport(address), timeout_s, retries), channel)
+
+
+# Runs an asyncio event loop in a background thread, so the synchronous control
+# loop can hand commands to the instruments and collect the results later.
+class InstrumentLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="InstrumentLoop", daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout_s=None):
+        return self.submit(coroutine).result(timeout_s)
+
+    def close(self):
+        self.run(self._cancel_tasks())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,62 @@
+import math
+import time
+import numpy as np
+import pytest
+from Logger import LOG_FIELDS, BatSimLogger
+from logReader import open_log
+
+
+def log_records(logger, count, first=0):
+    # Record i holds i + field number in every value field
+    for i in range(first, first + count):
+        logger.log_batsim_data(*(i + field for field in range(1, len(LOG_FIELDS))))
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # the logger writes into the current directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'binary'])
+def test_rotated_segments_are_gzipped(log_format):
+    logger = BatSimLogger(log_format=log_format, flush_interval_s=0.005, index_interval=16, rotate_size_bytes=2000)
+    for chunk in range(4):
+        # segments rotate at the next timed write once they are over the size
+        log_records(logger, 250, 250 * chunk)
+        logger.flush()
+        deadline = time.monotonic() + 1
+        while len(logger.segments) < chunk + 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+    logger.close()
+
+    assert len(logger.segments) == 5
+    assert all(segment.endswith('.gz') for segment in logger.segments[:-1])
+    assert [segment.split('_')[-1].split('.')[0] for segment in logger.segments] == ['000', '001', '002', '003',
+                                                                                     '004']
+
+    # the windows of the gzipped segments join into the whole run
+    values = np.concatenate([open_log(segment).window(0, math.inf)['vbatt_mv'] for segment in logger.segments])
+    np.testing.assert_array_equal(values, np.arange(1000) + 2)
+
+
+def test_existing_log_is_not_overwritten():
+    first = BatSimLogger(log_filename='batsim.csv')
+    log_records(first, 5)
+    first.close()
+    second = BatSimLogger(log_filename='batsim.csv')
+    log_records(second, 3)
+    second.close()
+
+    assert first.log_filename == 'batsim.csv'
+    assert second.log_filename == 'batsim-1.csv'
+    assert len(open_log('batsim.csv').window(0, math.inf)['time']) == 5
+    assert len(open_log('batsim-1.csv').window(0, math.inf)['time']) == 3
+
+
+def test_run_names_do_not_collide():
+    loggers = [BatSimLogger() for _ in range(3)]
+    for logger in loggers:
+        logger.close()
+
+    assert len({logger.log_filename for logger in loggers}) == 3
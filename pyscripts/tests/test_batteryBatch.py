@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from batteryBatch import BatSimBatch
+from batteryEngine import BatSimEngine
+from thermalModel import Table2D, TemperatureTables, ThermalModel
+
+OCV_TABLE = [3000 + 12 * i for i in range(101)]
+
+# one column per cell
+R_MOHMS = [5, 8, 12, 20]
+R1_MOHMS = [50, 30, 0, 80]
+R2_MOHMS = [10, 15, 20, 0]
+C1_F = [1000, 500, 2000, 0]
+C2_F = [10000, 0, 5000, 8000]
+RC_ENABLED = [True, False, True, True]
+INITIAL_PERCENT = [100, 80, 55.5, 30]
+CAPACITY_MAH = [2, 3, 1.5, 4]
+LOAD_MA = np.array([100, 250, -50, 400])
+
+
+def temperature_tables():
+    return TemperatureTables(ocv=Table2D([0, 50, 100], [0, 25, 45], [[2900, 3500, 3950], [3000, 3600, 4000],
+                                                                       [3020, 3620, 4010]]),
+                             r=Table2D([0, 100], [0, 45], [[30, 20], [10, 5]]),
+                             rc_r=[Table2D([0, 100], [0, 45], [[80, 60], [40, 30]])])
+
+
+def make_pair(thermal=False):
+    # The batch and one engine per cell with the same parameters
+    batch = BatSimBatch(len(R_MOHMS))
+    engines = [BatSimEngine() for _ in R_MOHMS]
+    if thermal:
+        batch.set_temperature_model(ThermalModel(ambient_c=5, heat_capacity_j_per_k=2), temperature_tables())
+        for engine in engines:
+            engine.set_temperature_model(ThermalModel(ambient_c=5, heat_capacity_j_per_k=2), temperature_tables())
+
+    batch.update_rc_params(RC_ENABLED, R_MOHMS, R1_MOHMS, R2_MOHMS, C1_F, C2_F, INITIAL_PERCENT, CAPACITY_MAH,
+                           OCV_TABLE)
+    for cell, engine in enumerate(engines):
+        engine.update_rc_params(RC_ENABLED[cell], R_MOHMS[cell], R1_MOHMS[cell], R2_MOHMS[cell], C1_F[cell],
+                                C2_F[cell], INITIAL_PERCENT[cell], CAPACITY_MAH[cell], OCV_TABLE)
+    return batch, engines
+
+
+def assert_same_state(batch, engines):
+    for cell, engine in enumerate(engines):
+        assert batch.vbatt_mv[cell] == pytest.approx(engine.vbatt_mv, rel=1e-12, abs=1e-9)
+        assert batch.vocv_mv[cell] == pytest.approx(engine.vocv_mv, rel=1e-12, abs=1e-9)
+        assert batch.current_battery_capacity_mas[cell] == pytest.approx(engine.current_battery_capacity_mas,
+                                                                         rel=1e-12, abs=1e-9)
+        assert batch.vr1c1_mv[cell] == pytest.approx(engine.vr1c1_mv, rel=1e-12, abs=1e-9)
+        assert batch.vr2c2_mv[cell] == pytest.approx(engine.vr2c2_mv, rel=1e-12, abs=1e-9)
+        assert batch.temperature_c[cell] == pytest.approx(engine.temperature_c, rel=1e-12)
+
+
+@pytest.mark.parametrize('thermal', [False, True])
+def test_batch_matches_engine_step_for_step(thermal):
+    batch, engines = make_pair(thermal)
+    # varying steps and loads, until some cells drain
+    for step in range(3000):
+        dt_s = 0.5 + step % 7
+        load_mA = LOAD_MA * (1 + step % 3)
+        batch.step(dt_s, load_mA)
+        for cell, engine in enumerate(engines):
+            engine.step(dt_s, load_mA[cell])
+        assert_same_state(batch, engines)
+
+    assert batch.is_drained().any() and not batch.is_drained().all()
+    np.testing.assert_array_equal(batch.is_drained(), [engine.is_drained() for engine in engines])
+
+
+def test_batch_run_matches_engine_run():
+    batch, engines = make_pair()
+    batch.run(1, 100, duration_s=30)
+    for engine in engines:
+        engine.run(1, 100, duration_s=30)
+
+    assert batch.elapsed_s == engines[0].elapsed_s
+    assert_same_state(batch, engines)
+
+
+def test_run_without_end_is_refused():
+    batch, _ = make_pair()
+    with pytest.raises(ValueError):
+        batch.run(1, LOAD_MA)
@@ -0,0 +1,83 @@
+import pytest
+from batteryEngine import BatSimEngine
+
+OCV_TABLE = [3000 + 12 * i for i in range(101)]
+
+
+def make_engine(rc_enabled=True, initial_percent=100, capacity_mah=100):
+    engine = BatSimEngine()
+    engine.update_rc_params(rc_enabled, 5, 50, 10, 1000, 10000, initial_percent, capacity_mah, OCV_TABLE)
+    return engine
+
+
+def test_run_until_drained():
+    engine = make_engine(capacity_mah=1)
+    steps = engine.run(1, 100)
+    assert engine.is_drained()
+    assert steps == 36
+    assert engine.elapsed_s == 36
+
+
+def test_run_for_duration():
+    engine = make_engine()
+    assert engine.run(1, 100, duration_s=10) == 10
+    assert engine.battery_capacity_percent == pytest.approx(100 - 1000 / 3600)
+
+
+@pytest.mark.parametrize('ibatt_mA', [0, -100])
+def test_run_without_end_is_refused(ibatt_mA):
+    with pytest.raises(ValueError):
+        make_engine().run(1, ibatt_mA)
+
+
+def sample_states(run):
+    # (elapsed_s, SoC, Vocv, Vbatt) every minute of a run
+    samples = []
+
+    def on_sample(engine):
+        if engine.elapsed_s % 60 == 0:
+            samples.append((engine.elapsed_s, engine.battery_capacity_percent, engine.vocv_mv, engine.vbatt_mv))
+
+    run(on_sample)
+    return samples
+
+
+def assert_same_samples(adaptive, fixed):
+    assert [sample[0] for sample in adaptive] == [sample[0] for sample in fixed]
+    for adaptive_sample, fixed_sample in zip(adaptive, fixed):
+        assert adaptive_sample == pytest.approx(fixed_sample, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize('initial_percent, capacity_mah, ibatt_mA', [(100, 100, 100), (100, 1, 1), (40, 2, 16), (55.5, 3, 33.3)])
+def test_run_adaptive_matches_fixed_steps(initial_percent, capacity_mah, ibatt_mA):
+    fixed = sample_states(lambda on_sample: make_engine(True, initial_percent, capacity_mah).run(
+        1, ibatt_mA, on_step=on_sample))
+    adaptive = sample_states(lambda on_sample: make_engine(True, initial_percent, capacity_mah).run_adaptive(
+        ibatt_mA, 60, on_sample=on_sample))
+
+    assert fixed[-1][1] == 0
+    assert_same_samples(adaptive, fixed)
+
+
+def test_run_adaptive_profile_matches_fixed_steps():
+    # a pulse every 10 minutes, breakpoints on whole seconds
+    profile = [(0, 20)]
+    for minute in range(0, 600, 10):
+        profile += [(minute * 60 + 5, 900), (minute * 60 + 35, 20)]
+    loads = [20] * 36000
+    for start_s, ibatt_mA in profile:
+        loads[start_s:] = [ibatt_mA] * (36000 - start_s)
+
+    def fixed_run(on_sample):
+        engine = make_engine(capacity_mah=50)
+        for ibatt_mA in loads:
+            engine.step(1, ibatt_mA)
+            on_sample(engine)
+            if engine.is_drained():
+                break
+
+    fixed = sample_states(fixed_run)
+    adaptive = sample_states(lambda on_sample: make_engine(capacity_mah=50).run_adaptive(
+        profile + [(36000, 0)], 60, on_sample=on_sample))
+
+    assert_same_samples(adaptive, fixed)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from batteryEngine import BatSimEngine
+from batteryFit import FitResult
+from batteryLogic import BatSimCore
+from Logger import BatSimLogger
+from ocvTable import OcvTable
+
+OCV_TABLE = OcvTable.from_list([3000 + 12 * i for i in range(101)])
+
+
+@pytest.mark.parametrize('branches', [1, 2, 3])
+def test_apply_any_branch_count(branches, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = FitResult(7, np.arange(1, branches + 1) * 20.0, np.arange(1, branches + 1) * 500.0, OCV_TABLE, 0.1)
+    engine = BatSimEngine()
+    result.apply(engine, 80, 50)
+    core = BatSimCore(log=BatSimLogger())
+    result.apply(core, 80, 50)
+    core.log.close()
+
+    for target in (engine, core.engine):
+        np.testing.assert_array_equal(target.rc_r_mohms, result.rc_r_mohms)
+        np.testing.assert_array_equal(target.rc_c_F, result.rc_c_F)
+        assert target.r_mohms == 7
+        assert target.battery_capacity_percent == 80
+        assert target.battery_capacity_mah == 50
@@ -0,0 +1,80 @@
+import collections
+import threading
+import time
+import pytest
+from BatSimHardware import BatSimHw
+from batteryLogic import BatSimCore
+from controlLoop import ControlLoop
+from Logger import BatSimLogger
+
+OCV_TABLE = [3000 + 12 * i for i in range(101)]
+
+
+@pytest.fixture
+def core(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batsimHw = BatSimHw()
+    batsimHw.set_ibatt_load_ma(100)
+    core = BatSimCore(batsimHw, BatSimLogger())
+    core.update_rc_params(True, 5, 50, 10, 1000, 10000, 100, 1, OCV_TABLE)
+    yield core
+    core.stop()
+    core.log.close()
+
+
+def test_control_tick_without_loop_drains(core):
+    # driven directly like the benchmark, a drained battery has no loop to stop
+    core.set_control_period(1000)
+    for tick in range(1, 40):
+        snapshot = core.control_tick(tick)
+    assert core.engine.is_drained()
+    assert snapshot[0] == 39
+
+
+def test_run_until_drained(core):
+    stopped = threading.Event()
+    errors = []
+    core.subscribe_stopped(lambda error: (errors.append(error), stopped.set()))
+    core.update_rc_params(True, 5, 50, 10, 1000, 10000, 100, 0.01, OCV_TABLE)
+    core.set_control_period(2)
+    core.start()
+    control_loop = core.control_loop
+    # starting a running core does nothing
+    core.start()
+    assert core.control_loop is control_loop
+
+    assert stopped.wait(5)
+    assert errors == [None]
+    assert not core.running
+    assert core.engine.is_drained()
+    # 36 mAs at 100 mA, a rounding residue may take one more tick
+    assert core.engine.elapsed_s == pytest.approx(0.36, abs=0.0021)
+
+
+def test_control_loop_period():
+    ticks = []
+    loop = ControlLoop(ticks.append, 0.005, align=True)
+    loop.start()
+    time.sleep(0.2)
+    loop.stop()
+    # deadlines on the grid of the period, one period apart
+    assert len(ticks) >= 20
+    assert all(abs(later - earlier - 0.005) < 1e-6 for earlier, later in zip(ticks, ticks[1:]))
+    assert all(abs(deadline / 0.005 - round(deadline / 0.005)) < 1e-6 for deadline in ticks)
+    assert loop.ticks == len(ticks)
+
+
+def test_tick_subscribers_get_every_tick(core):
+    ticks = collections.deque()
+    stopped = threading.Event()
+    core.subscribe_ticks(ticks.append)
+    core.subscribe_stopped(lambda error: stopped.set())
+    core.update_rc_params(True, 5, 50, 10, 1000, 10000, 100, 0.01, OCV_TABLE)
+    core.set_control_period(2)
+    core.start()
+    assert stopped.wait(5)
+
+    assert len(ticks) == core.control_loop.ticks
+    times = [snapshot[0] for snapshot in ticks]
+    assert times == sorted(set(times))
+    assert ticks[-1][8] == 0
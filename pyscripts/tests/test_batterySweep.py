@@ -0,0 +1,70 @@
+import pytest
+from batteryEngine import BatSimEngine
+from batterySweep import run_sweep, simulate_run
+from ocvTable import OcvTable
+
+OCV_TABLE = OcvTable.from_list([3000 + 12 * i for i in range(101)])
+PARAMETERS = {'r_mohms': 5, 'r1_mohms': 50, 'c1_F': 1000, 'r2_mohms': 10, 'c2_F': 10000, 'battery_capacity_mah': 100,
+              'battery_initial_capacity_percent': 100}
+
+
+def test_cutoff_between_samples_ends_the_soc_curve_once():
+    summary = simulate_run(0, PARAMETERS, OCV_TABLE, 100, 60, None, 3600)
+    times = [time_s for time_s, _ in summary['soc_curve']]
+    assert times[-1] == summary['time_to_cutoff_s']
+    assert times == sorted(set(times))
+    assert times[-2] == 1740
+
+
+def pulsed_profile():
+    # 2 s pulses of 3 A every 100 s over a 20 mA base load, shorter than the samples
+    profile = []
+    for pulse in range(40):
+        profile += [(pulse * 100, 20), (pulse * 100 + 30, 3000), (pulse * 100 + 32, 20)]
+    return profile + [(4000, 0)]
+
+
+def fixed_step_reference(parameters, profile, cutoff_mv, dt_s=0.01):
+    # (first time Vbatt <= cutoff_mv, minimum Vbatt up to then) with steps of dt_s
+    engine = BatSimEngine()
+    engine.update_rc_params(True, parameters['r_mohms'], parameters['r1_mohms'], parameters['r2_mohms'],
+                            parameters['c1_F'], parameters['c2_F'], parameters['battery_initial_capacity_percent'],
+                            parameters['battery_capacity_mah'], OCV_TABLE)
+    min_vbatt_mv = None
+    for (start_s, ibatt_mA), (end_s, _) in zip(profile, profile[1:]):
+        for _ in range(round((end_s - start_s) / dt_s)):
+            engine.step(dt_s, ibatt_mA)
+            min_vbatt_mv = engine.vbatt_mv if min_vbatt_mv is None else min(min_vbatt_mv, engine.vbatt_mv)
+            if engine.is_drained() or (cutoff_mv is not None and engine.vbatt_mv <= cutoff_mv):
+                return engine.elapsed_s, min_vbatt_mv
+
+
+@pytest.mark.parametrize('cutoff_mv', [3700, None])
+def test_pulses_between_samples_reach_the_cutoff(cutoff_mv):
+    parameters = dict(PARAMETERS, r_mohms=50, c1_F=100, r2_mohms=20, c2_F=1000, battery_capacity_mah=20)
+    summary = simulate_run(0, parameters, OCV_TABLE, pulsed_profile(), 60, None, cutoff_mv)
+    time_s, min_vbatt_mv = fixed_step_reference(parameters, pulsed_profile(), cutoff_mv)
+
+    assert summary['time_to_cutoff_s'] == pytest.approx(time_s, abs=0.011)
+    assert summary['min_vbatt_mv'] == pytest.approx(min_vbatt_mv, abs=1 if cutoff_mv else 1e-6)
+    if cutoff_mv is not None:
+        assert summary['min_vbatt_mv'] == pytest.approx(cutoff_mv, abs=0.1)
+        # the cutoff is in the 3rd pulse, long before the sample after it
+        assert summary['soc_curve'][-2][0] == 180
+
+
+def test_sweep_only_depends_on_the_seed():
+    distributions = {'r_mohms': ['normal', 5, 0.5], 'r1_mohms': ['uniform', 40, 60], 'c1_F': 1000,
+                     'r2_mohms': ['lognormal', 2.3, 0.1], 'c2_F': 10000, 'battery_capacity_mah': ['normal', 2, 0.2],
+                     'battery_initial_capacity_percent': 100}
+
+    def sweep(workers, chunk_size):
+        summaries = run_sweep(distributions, OCV_TABLE, 100, 6, seed=7, workers=workers, chunk_size=chunk_size,
+                              cutoff_mv=3500)
+        return sorted(summaries, key=lambda summary: summary['run'])
+
+    reference = sweep(1, 6)
+    assert [summary['run'] for summary in reference] == list(range(6))
+    assert len({summary['parameters']['r_mohms'] for summary in reference}) == 6
+    assert sweep(2, 1) == reference
+    assert sweep(3, 4) == reference
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from chartHistory import DecimationPyramid
+
+
+def build(count, factor=4, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.arange(count) * 0.5
+    y = rng.normal(0, 1, count)
+    # one sample spikes, the way a load pulse does
+    y[count // 3] = 50
+    y[2 * count // 3] = -50
+    pyramid = DecimationPyramid(factor)
+    for sample_x, sample_y in zip(x, y):
+        pyramid.append(sample_x, sample_y)
+    return pyramid, x, y
+
+
+@pytest.mark.parametrize('factor', [2, 4, 10])
+def test_window_keeps_the_extremes(factor):
+    pyramid, x, y = build(5000, factor)
+    assert len(pyramid) == 5000
+    assert pyramid.x_range == (x[0], x[-1])
+    assert (pyramid.y_min, pyramid.y_max) == (-50, 50)
+
+    samples = dict(zip(x, y))
+    rng = np.random.default_rng(2)
+    for _ in range(50):
+        x_start, x_end = np.sort(rng.uniform(-10, x[-1] + 10, 2))
+        max_points = int(rng.integers(4, 400))
+        window_x, window_y = pyramid.window(x_start, x_end, max_points)
+
+        # the samples in the window plus one on each side
+        first = max(np.searchsorted(x, x_start, side='left') - 1, 0)
+        last = min(np.searchsorted(x, x_end, side='right') + 1, len(x))
+        assert window_y.min() == y[first:last].min()
+        assert window_y.max() == y[first:last].max()
+        assert x[first] <= window_x[0] and window_x[-1] <= x[last - 1]
+        assert np.all(np.diff(window_x) >= 0)
+        # only real samples, and few of them
+        assert all(samples[point_x] == point_y for point_x, point_y in zip(window_x, window_y))
+        assert len(window_x) <= 2 * max_points + 4 * factor * len(pyramid.levels)
+
+
+def test_whole_run_in_a_few_points():
+    pyramid, x, y = build(100000)
+    window_x, window_y = pyramid.window(x[0], x[-1], 100)
+    assert len(window_x) <= 300
+    assert window_y.max() == 50 and window_y.min() == -50
+
+
+def test_short_window_is_raw():
+    pyramid, x, y = build(1000)
+    window_x, window_y = pyramid.window(x[100], x[120], 100)
+    np.testing.assert_array_equal(window_x, x[99:122])
+    np.testing.assert_array_equal(window_y, y[99:122])
@@ -0,0 +1,52 @@
+import time
+import pytest
+from controlLoop import ControlLoop
+from instrumentPool import InstrumentPool
+from scpiEmulator import ScpiEmulator
+from scpiInstrument import InstrumentLoop
+
+
+@pytest.fixture
+def emulator():
+    server = InstrumentLoop()
+    emulator = ScpiEmulator(latency_s=0.002, channels=4, load_ohms=20)
+    emulator.address = f'tcp://127.0.0.1:{server.run(emulator.start())}'
+    yield emulator
+    server.run(emulator.stop())
+    server.close()
+
+
+def test_one_transaction_per_tick(emulator):
+    pool = InstrumentPool()
+    hws = [pool.batsim_hw(emulator.address, channel) for channel in range(1, 5)]
+    currents = [[] for _ in hws]
+
+    def tick(deadline_s, channel):
+        currents[channel].append(hws[channel].measure_ibatt_ma())
+        hws[channel].set_vbatt_mv(3000 + 100 * channel)
+
+    loops = [ControlLoop(lambda deadline_s, channel=channel: tick(deadline_s, channel), 0.02, align=True)
+             for channel in range(len(hws))]
+    try:
+        # the first ticks connect
+        for hw in hws:
+            hw.measure_ibatt_ma()
+        emulator.messages = 0
+        for loop in loops:
+            loop.start()
+        time.sleep(1)
+        for loop in loops:
+            loop.stop()
+        multiplexer = pool.multiplexer(emulator.address)
+    finally:
+        pool.close()
+
+    ticks = sum(loop.ticks for loop in loops) / len(loops)
+    assert ticks >= 40
+    assert all(loop.error is None for loop in loops)
+    # the 4 channels of a tick share one message, a late tick may take a second one
+    assert emulator.messages / ticks <= 1.2
+    assert multiplexer.transactions >= ticks
+    assert emulator.voltage_v == [3.0, 3.1, 3.2, 3.3]
+    # the measured currents follow the voltages set in the previous ticks
+    assert [channel_currents[-1] for channel_currents in currents] == pytest.approx([150, 155, 160, 165])
@@ -0,0 +1,99 @@
+import math
+import numpy as np
+import pytest
+from Logger import LOG_FIELDS, BatSimLogger
+from logReader import BinaryLog, CsvLog, open_log
+
+
+def log_records(logger, count, first=0):
+    # Record i holds i + field number in every value field
+    for i in range(first, first + count):
+        logger.log_batsim_data(*(i + field for field in range(1, len(LOG_FIELDS))))
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # the logger writes into the current directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize('value_dtype', ['<f8', '<f4'])
+def test_binary_log_round_trip(value_dtype):
+    logger = BatSimLogger(log_format='binary', value_dtype=value_dtype, flush_size=100)
+    logger.set_parameters({'r_mohms': 5})
+    log_records(logger, 1000)
+    logger.close()
+
+    assert logger.log_filename.endswith('.bin')
+    log = open_log(logger.log_filename)
+    assert isinstance(log, BinaryLog)
+    assert len(log) == 1000
+    assert log.parameters == {'r_mohms': 5}
+    assert log.dtype['time'] == np.dtype('<f8')
+    assert log.dtype['vbatt_mv'] == np.dtype(value_dtype)
+    assert np.all(np.diff(log.column('time')) >= 0)
+    for field in range(1, len(LOG_FIELDS)):
+        np.testing.assert_array_equal(log.column(LOG_FIELDS[field]), np.arange(1000) + field)
+
+
+def test_binary_log_to_csv_matches_csv_log():
+    binary = BatSimLogger(log_format='binary')
+    csv = BatSimLogger(log_format='csv')
+    for logger in (binary, csv):
+        log_records(logger, 100)
+        logger.close()
+
+    open_log(binary.log_filename).to_csv('converted.csv', chunk_rows=7)
+    assert isinstance(open_log(csv.log_filename), CsvLog)
+    with open('converted.csv') as converted, open(csv.log_filename) as written:
+        converted_lines = converted.read().splitlines()
+        written_lines = written.read().splitlines()
+
+    assert converted_lines[0] == written_lines[0]
+    assert len(converted_lines) == len(written_lines) == 101
+    # the timestamps differ, the values are the same
+    assert [line.split(', ')[1:] for line in converted_lines[1:]] == \
+           [[str(float(value)) for value in line.split(', ')[1:]] for line in written_lines[1:]]
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'binary'])
+def test_window(log_format):
+    logger = BatSimLogger(log_format=log_format, flush_size=100, index_interval=64)
+    log_records(logger, 1000)
+    logger.close()
+
+    log = open_log(logger.log_filename)
+    window = log.window(0, math.inf)
+    times = window['time']
+    assert len(times) == 1000
+    for field in range(1, len(LOG_FIELDS)):
+        np.testing.assert_array_equal(window[LOG_FIELDS[field]], np.arange(1000) + field)
+
+    # the index only narrows the read, the window holds exactly the records logged in it
+    for first, last in [(0, 999), (300, 700), (64, 128), (999, 999)]:
+        middle = log.window(times[first], times[last])
+        selected = (times >= times[first]) & (times <= times[last])
+        np.testing.assert_array_equal(middle['time'], times[selected])
+        np.testing.assert_array_equal(middle['vbatt_mv'], window['vbatt_mv'][selected])
+
+    assert len(log.window(times[-1] + 1, math.inf)['time']) == 0
+    downsampled = log.window(0, math.inf, max_points=10)
+    assert len(downsampled['time']) <= 10
+    np.testing.assert_array_equal(downsampled['vbatt_mv'], window['vbatt_mv'][::100])
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'binary'])
+def test_window_of_a_log_being_written(log_format):
+    logger = BatSimLogger(log_format=log_format, index_interval=16)
+    log_records(logger, 100)
+    logger.flush()
+
+    log = open_log(logger.log_filename)
+    assert len(log.window(0, math.inf)['time']) == 100
+    assert log.start_time == pytest.approx(log.window(0, math.inf)['time'][0])
+
+    log_records(logger, 150, 100)
+    logger.flush()
+    log.refresh()
+    np.testing.assert_array_equal(log.window(0, math.inf)['vbatt_mv'], np.arange(250) + 2)
+    logger.close()
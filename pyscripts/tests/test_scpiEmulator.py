@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from scpiEmulator import DATA_TYPE_ERROR, NO_ERROR, SUFFIX_OUT_OF_RANGE, UNDEFINED_HEADER, ScpiEmulator
+from scpiInstrument import ScpiInstrument, open_transport
+
+
+def test_commands():
+    emulator = ScpiEmulator(channels=2, load_mA=250)
+    assert emulator.execute('*IDN?\n').startswith('KEITHLEY INSTRUMENTS INC.,MODEL 2308')
+    assert emulator.execute(':SOUR2:VOLT 3.5') is None
+    assert emulator.execute('SOURce2:VOLTage?') == '3.5000'
+    assert emulator.execute('SOUR:VOLT:LEV?') == '0.0000'
+    assert emulator.execute('MEAS:CURR?') == '0.250000'
+    assert emulator.execute('read2:volt?') == '3.5000'
+    assert emulator.execute('SOUR1:VOLT 4.1;MEAS1:VOLT?;MEAS2:CURR?;*OPC?') == '4.1000;0.250000;1'
+    assert emulator.execute('*RST;SOUR2:VOLT?') == '0.0000'
+    assert emulator.execute('SYST:ERR?') == NO_ERROR
+    assert emulator.messages == 9
+    assert emulator.commands == 13
+
+
+def test_load_ohms():
+    emulator = ScpiEmulator(channels=1, load_ohms=10)
+    emulator.execute('SOUR:VOLT 4')
+    assert emulator.execute('MEAS:CURR?') == '0.400000'
+
+
+def test_rejected_commands_go_to_the_error_queue():
+    emulator = ScpiEmulator(channels=2)
+    # a rejected query answers with its error, a rejected set answers nothing
+    assert emulator.execute('MEAS3:CURR?;MEAS2:CURR?') == SUFFIX_OUT_OF_RANGE + ';0.100000'
+    assert emulator.execute('SOUR0:VOLT 1') is None
+    assert emulator.execute('SOUR2:VOLT abc;FOO?;BAR') == UNDEFINED_HEADER
+    assert emulator.voltage_v == [0.0, 0.0]
+
+    errors = [emulator.execute('SYSTem:ERRor:NEXT?') for _ in range(6)]
+    assert errors == [SUFFIX_OUT_OF_RANGE, SUFFIX_OUT_OF_RANGE, DATA_TYPE_ERROR, UNDEFINED_HEADER, UNDEFINED_HEADER,
+                      NO_ERROR]
+
+    emulator.execute('SOUR5:VOLT 1;*CLS')
+    assert emulator.execute('SYST:ERR?') == NO_ERROR
+
+
+def test_connection_survives_rejected_commands():
+    async def session():
+        emulator = ScpiEmulator(channels=2)
+        port = await emulator.start()
+        scpi = ScpiInstrument(open_transport(f'tcp://127.0.0.1:{port}'), timeout_s=1.0, retries=0)
+        await scpi.connect()
+        try:
+            responses = [await scpi.query('MEAS4:CURR?'), await scpi.query('SYST:ERR?'),
+                         await scpi.query('MEAS2:CURR?')]
+        finally:
+            await scpi.close()
+            await emulator.stop()
+        return responses
+
+    assert asyncio.run(session()) == [SUFFIX_OUT_OF_RANGE, SUFFIX_OUT_OF_RANGE, '0.100000']
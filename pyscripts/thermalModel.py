@@ -0,0 +1,81 @@
+import math
+from ocvTable import BreakpointIndex
+
+
+# Parameter table over (SoC %, temperature in degC), bilinear interpolation
+# between the grid points. values[t][s] is the value at temperature_c[t] and
+# soc_percent[s]. Both axes go through a BreakpointIndex, so lookups stay
+# O(1) as the tables grow.
+class Table2D:
+    def __init__(self, soc_percent, temperature_c, values):
+        if len(values) != len(temperature_c) or any(len(row) != len(soc_percent) for row in values):
+            raise ValueError("Table needs one row per temperature and one column per SoC breakpoint")
+
+        self.soc_index = BreakpointIndex(soc_percent)
+        self.temperature_index = BreakpointIndex(temperature_c)
+        self.soc_percent = self.soc_index.breakpoints
+        self.temperature_c = self.temperature_index.breakpoints
+        self.values = [[float(value) for value in row] for row in values]
+
+    @classmethod
+    def constant(cls, value):
+        # Same value everywhere, handy for parameters that do not depend on temperature
+        return cls([0, 100], [-40, 85], [[value, value], [value, value]])
+
+    def lookup(self, soc_percent, temperature_c):
+        s, soc_fraction = self.soc_index.locate(soc_percent)
+        t, temperature_fraction = self.temperature_index.locate(temperature_c)
+
+        row0 = self.values[t]
+        row1 = self.values[t + 1]
+        value0 = row0[s] + (row0[s + 1] - row0[s]) * soc_fraction
+        value1 = row1[s] + (row1[s + 1] - row1[s]) * soc_fraction
+
+        return value0 + (value1 - value0) * temperature_fraction
+
+
+def heat_power_w(ibatt_mA, r_mohms, vrc_mv, rc_r_mohms):
+    # Joule heating in the series resistor and in the resistor of every RC branch
+    power_w = ibatt_mA * ibatt_mA * r_mohms * 1e-9
+    for vrc, rc_r in zip(vrc_mv, rc_r_mohms):
+        if rc_r > 0:
+            power_w += vrc * vrc / rc_r * 1e-3
+
+    return float(power_w)
+
+
+# Lumped thermal model of the cell: one heat capacity connected to the ambient
+# through one thermal resistance. Integrated exactly for a constant heat
+# power over the step, like the RC branches.
+class ThermalModel:
+    def __init__(self, ambient_c=25, heat_capacity_j_per_k=40, thermal_resistance_k_per_w=20, initial_c=None):
+        self.ambient_c = ambient_c
+        self.heat_capacity_j_per_k = heat_capacity_j_per_k
+        self.thermal_resistance_k_per_w = thermal_resistance_k_per_w
+        self.initial_c = ambient_c if initial_c is None else initial_c
+        self.temperature_c = self.initial_c
+
+    def reset(self):
+        self.temperature_c = self.initial_c
+
+    def step(self, dt_s, power_w):
+        steady_state_c = self.ambient_c + power_w * self.thermal_resistance_k_per_w
+        tau = self.heat_capacity_j_per_k * self.thermal_resistance_k_per_w
+
+        if tau > 0:
+            self.temperature_c = steady_state_c + (self.temperature_c - steady_state_c) * math.exp(-dt_s / tau)
+        else:
+            self.temperature_c = steady_state_c
+
+        return self.temperature_c
+
+
+# OCV and impedance as functions of SoC and temperature. rc_r and rc_c hold
+# one table per RC branch. Tables left as None keep the value given to
+# update_rc_params.
+class TemperatureTables:
+    def __init__(self, ocv=None, r=None, rc_r=(), rc_c=()):
+        self.ocv = ocv
+        self.r = r
+        self.rc_r = list(rc_r)
+        self.rc_c = list(rc_c)
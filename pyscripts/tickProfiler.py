@@ -0,0 +1,52 @@
+import time
+import numpy as np
+
+# Stages of a control tick, in the order they run. `commands` are the queued
+# parameter and load changes, `publish` hands the snapshot to the GUI.
+TICK_STAGES = ('commands', 'measure', 'ocv', 'rc', 'set', 'log', 'publish')
+STAGE_COMMANDS, STAGE_MEASURE, STAGE_OCV, STAGE_RC, STAGE_SET, STAGE_LOG, STAGE_PUBLISH = range(len(TICK_STAGES))
+
+
+# Time spent in every stage of the last `window` ticks. A tick is start(), then
+# mark(stage) at the end of each stage, the stage taking the time since the
+# previous mark, then end(). Recording is a perf_counter_ns() and a list store per
+# stage; the percentiles are only computed when stats() is asked for, e.g. from
+# another thread while the loop keeps running.
+class TickProfiler:
+    def __init__(self, stages=TICK_STAGES, window=1000):
+        self.stages = stages
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.samples = [[0] * self.window for _ in self.stages]
+        self._position = 0
+        self._last = 0
+
+    def start(self):
+        self._last = time.perf_counter_ns()
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        self.samples[stage][self._position] = now - self._last
+        self._last = now
+
+    def end(self):
+        self.ticks += 1
+        self._position = self.ticks % self.window
+
+    def stats(self):
+        # {stage: {mean_us, p50_us, p90_us, p99_us, max_us}} over the last ticks,
+        # 'total' for the whole tick
+        count = min(self.ticks, self.window)
+        if count == 0:
+            return {}
+
+        samples = np.array([stage_samples[:count] for stage_samples in self.samples], dtype=np.float64) / 1000
+        stats = {}
+        for name, values in zip(self.stages + ('total',), list(samples) + [samples.sum(axis=0)]):
+            p50, p90, p99 = np.percentile(values, (50, 90, 99))
+            stats[name] = {'mean_us': float(values.mean()), 'p50_us': float(p50), 'p90_us': float(p90),
+                           'p99_us': float(p99), 'max_us': float(values.max())}
+        return stats